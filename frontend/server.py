@@ -6,10 +6,14 @@ from flask import Flask, render_template, abort, redirect, request
 from scripts.collaborative_filtering import collaboration_filtering
 from scripts.content_based_algo import algorithm_related, algorithm_related_with_category
 from scripts.naive_algo import recommend_products_by_related, recommend_products_by_category
-from scripts.random_algo import recommend_products_randomly
+from scripts.random_algo import get_item_sampler, recommend_products_randomly
 from scripts.utils import create_connection
 
 app = Flask(__name__)
+ITEM_QUERY = "SELECT * FROM item WHERE id=?"
+FEEDBACK_INSERT_QUERY = ("INSERT INTO algo_evaluation(itemId, random, relatedAll, relatedAlsoBought, "
+                         "relatedAlsoViewed, sameCategory, siblingCategory, collaborativeFiltering, contentBased, "
+                         "contentBasedWithCategory) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
 TYPES_OF_ALGORITHMS = [
     "random",
     "related_all",
@@ -27,7 +31,7 @@ def get_item_dict(item_id: str) -> dict:
     connection = create_connection()
 
     with connection:
-        cursor = connection.execute('''SELECT * FROM item WHERE id="{}"'''.format(item_id))
+        cursor = connection.execute(ITEM_QUERY, [item_id])
         item = cursor.fetchone()
 
         if item is None:
@@ -81,18 +85,12 @@ def get_recommendation(item_id: str, algo_type: str) -> (list, str):
 
 
 def get_random_item_id():
-    connection = create_connection()
-
-    with connection:
-        cursor = connection.execute("SELECT id FROM item ORDER BY RANDOM() LIMIT 1")
-        item_id = cursor.fetchone()[0]
-
-    return item_id
+    return get_item_sampler().sample(1)[0]
 
 
 def get_int_value(value: str):
     if value is None:
-        return "NULL"
+        return None
 
     value_int = {
         "great": 4,
@@ -106,11 +104,7 @@ def get_int_value(value: str):
 
 @app.route("/")
 def index():
-    connection = create_connection()
-
-    with connection:
-        cursor = connection.execute("SELECT id FROM item ORDER BY RANDOM() LIMIT 120")
-        all_items = [get_item_dict(item[0]) for item in cursor.fetchall()]
+    all_items = [get_item_dict(item_id) for item_id in get_item_sampler().sample(120)]
 
     return render_template("main_page.html", products=all_items)
 
@@ -150,17 +144,7 @@ def feedback(item_id: str):
         for algo_type in TYPES_OF_ALGORITHMS:
             to_insert.append(get_int_value(request.form.get(algo_type, None)))
 
-        query = '''
-            INSERT INTO algo_evaluation(
-                itemId, 
-                random, 
-                relatedAll, relatedAlsoBought, relatedAlsoViewed, 
-                sameCategory, siblingCategory, 
-                collaborativeFiltering,
-                contentBased, contentBasedWithCategory)
-            VALUES {}
-        '''.format(tuple(to_insert))
-        connection.execute(query)
+        connection.execute(FEEDBACK_INSERT_QUERY, to_insert)
 
     item_id = get_random_item_id()
     new_url = "/product/{}?submitted_feedback=true".format(item_id)
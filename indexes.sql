@@ -0,0 +1,13 @@
+CREATE INDEX IF NOT EXISTS review_item_user ON review(itemId, userId, rating);
+
+CREATE INDEX IF NOT EXISTS review_user_item ON review(userId, itemId, reviewTime);
+
+CREATE INDEX IF NOT EXISTS item_related_list_item ON item_related_list(itemId, relation, relatedItemId);
+
+CREATE INDEX IF NOT EXISTS item_category_list_item ON item_category_list(itemId, categoryId);
+
+CREATE INDEX IF NOT EXISTS item_category_list_category ON item_category_list(categoryId, itemId);
+
+CREATE INDEX IF NOT EXISTS category_parent ON category(parentCategoryId, id);
+
+CREATE INDEX IF NOT EXISTS category_closure_descendant ON category_closure(descendantId, ancestorId, depth);
\ No newline at end of file
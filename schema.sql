@@ -30,11 +30,37 @@ CREATE TABLE IF NOT EXISTS category (id INTEGER NOT NULL PRIMARY KEY,
                                      name TEXT NOT NULL,
                                      FOREIGN KEY (parentCategoryId) REFERENCES category(id));
 
+CREATE TABLE IF NOT EXISTS category_closure (ancestorId INTEGER NOT NULL,
+                                             descendantId INTEGER NOT NULL,
+                                             depth INTEGER NOT NULL,
+                                             PRIMARY KEY (ancestorId, descendantId),
+                                             FOREIGN KEY (ancestorId) REFERENCES category(id),
+                                             FOREIGN KEY (descendantId) REFERENCES category(id));
+
 CREATE TABLE IF NOT EXISTS item_category_list (itemId TEXT NOT NULL,
 									                             categoryId INTEGER NOT NULL,
 									                             FOREIGN KEY (itemId) REFERENCES item(id),
 									                             FOREIGN KEY (categoryId) REFERENCES category(id));
 
+CREATE TABLE IF NOT EXISTS item_neighbor (itemId TEXT NOT NULL,
+                                          rank INTEGER NOT NULL,
+                                          neighborItemId TEXT NOT NULL,
+                                          similarity REAL NOT NULL,
+                                          PRIMARY KEY (itemId, rank),
+                                          FOREIGN KEY (itemId) REFERENCES item(id),
+                                          FOREIGN KEY (neighborItemId) REFERENCES item(id));
+
+CREATE TABLE IF NOT EXISTS item_neighbor_fingerprint (fingerprint TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS category_ranking (groupType TEXT NOT NULL,
+                                             groupId INTEGER NOT NULL,
+                                             rank INTEGER NOT NULL,
+                                             itemId TEXT NOT NULL,
+                                             rating REAL,
+                                             PRIMARY KEY (groupType, groupId, rank),
+                                             FOREIGN KEY (groupId) REFERENCES category(id),
+                                             FOREIGN KEY (itemId) REFERENCES item(id));
+
 CREATE TABLE IF NOT EXISTS algo_evaluation (id INTEGER NOT NULL PRIMARY KEY,
                                             itemId TEXT NOT NULL,
                                             random INT,
@@ -47,4 +73,14 @@ CREATE TABLE IF NOT EXISTS algo_evaluation (id INTEGER NOT NULL PRIMARY KEY,
                                             contentBased INT,
                                             contentBasedWithCategory INT,
                                             TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                            FOREIGN KEY (itemId) REFERENCES item(id));
\ No newline at end of file
+                                            FOREIGN KEY (itemId) REFERENCES item(id));
+
+CREATE TABLE IF NOT EXISTS item_rating_aggregate (itemId TEXT NOT NULL PRIMARY KEY,
+                                                  ratingSum REAL NOT NULL,
+                                                  ratingCount INTEGER NOT NULL);
+
+CREATE TABLE IF NOT EXISTS ingest_checkpoint (filePath TEXT NOT NULL,
+                                              fileSize INTEGER NOT NULL,
+                                              offset INTEGER NOT NULL,
+                                              finished INTEGER NOT NULL DEFAULT 0,
+                                              PRIMARY KEY (filePath, fileSize));
\ No newline at end of file
@@ -0,0 +1,82 @@
+import argparse
+import time
+
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+from scripts.collaborative_filtering import AlsRecommender, KnnRecommender, LshIndex, get_rows
+from scripts.interning import get_item_interner
+
+
+def query_neighbors(model, data, rows, n_neighbors) -> (list, float):
+    """
+    return neighbors of given rows (without the row itself) one query
+    at a time, as collaboration_filtering asks, and mean query time
+    """
+    neighbors = []
+    t0 = time.time()
+    for row in rows:
+        _, indices = model.kneighbors(data[row], n_neighbors=n_neighbors + 1)
+        neighbors.append([index for index in indices[0].tolist() if index != row][:n_neighbors])
+    return neighbors, (time.time() - t0) / len(rows)
+
+
+def query_als(als, rows, n_neighbors) -> (list, float):
+    """
+    return neighbors of given rows by factors of AlsRecommender one query at a time and mean query time
+    """
+    neighbors = []
+    t0 = time.time()
+    for row in rows:
+        recommends = als.make_recommendations(get_item_interner().keys[als.item_codes[row]], n_neighbors)
+        neighbors.append(get_rows(als.rows_by_code, recommends).tolist())
+    return neighbors, (time.time() - t0) / len(rows)
+
+
+def benchmark(n_queries, n_neighbors, n_tables, n_bits):
+    recommender = KnnRecommender()
+    data = recommender.item_user_mat_sparse
+    rows = np.random.RandomState(0).choice(data.shape[0], min(n_queries, data.shape[0]), replace=False)
+
+    brute = NearestNeighbors(algorithm='brute', metric='cosine').fit(data)
+    exact, brute_time = query_neighbors(brute, data, rows, n_neighbors)
+
+    t0 = time.time()
+    lsh = LshIndex(n_tables=n_tables, n_bits=n_bits).fit(data)
+    fit_time = time.time() - t0
+    approximate, lsh_time = query_neighbors(lsh, data, rows, n_neighbors)
+
+    recall = np.mean([len(set(a).intersection(e)) / len(e) for a, e in zip(approximate, exact)])
+
+    t0 = time.time()
+    als = AlsRecommender(data, recommender.item_codes)
+    als_fit_time = time.time() - t0
+    factorized, als_time = query_als(als, rows, n_neighbors)
+    overlap = np.mean([len(set(f).intersection(e)) / len(e) for f, e in zip(factorized, exact)])
+
+    print("Items: {}, users: {}, queries: {}".format(data.shape[0], data.shape[1], len(rows)))
+    print("brute:                    {:8.2f} ms per query".format(brute_time * 1000))
+    print("lsh ({} tables, {} bits):  {:8.2f} ms per query, fit took {:.2f}s".format(
+        n_tables, lsh.n_bits_, lsh_time * 1000, fit_time))
+    print("als ({} factors):         {:8.2f} ms per query, fit took {:.2f}s".format(
+        als.factors, als_time * 1000, als_fit_time))
+    print("recall@{} of lsh against brute: {:.3f}".format(n_neighbors, recall))
+    print("overlap@{} of als with brute:   {:.3f}".format(n_neighbors, overlap))
+
+
+# run after setup_db.py
+# e.g. python3 scripts/benchmark_ann.py --tables 16 --bits 8, without --bits LshIndex derives it from the data
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200,
+                        help="This is a number of random items whose neighbors are queried.")
+    parser.add_argument("--neighbors", type=int, default=10,
+                        help="This is a number of neighbors recall is computed for.")
+    parser.add_argument("--tables", type=int, default=16,
+                        help="This is a number of hash tables of LshIndex.")
+    parser.add_argument("--bits", type=int, default=None,
+                        help="This is a number of hyperplanes (bits of a bucket code) per hash table of LshIndex, "
+                             "derived from the data if not given.")
+    args = parser.parse_args()
+
+    benchmark(args.queries, args.neighbors, args.tables, args.bits)
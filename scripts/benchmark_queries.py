@@ -0,0 +1,209 @@
+import argparse
+import sys
+import time
+from sqlite3 import Connection
+
+from frontend.server import FEEDBACK_INSERT_QUERY, ITEM_QUERY
+from scripts.category_rankings import RANKING_DELETE_QUERY, RANKING_INSERT_QUERIES, RANKING_ITEMS_QUERY, RANKING_SIZE
+from scripts.category_tree import CATEGORY_CLOSURE_DELETE_QUERY, CATEGORY_CLOSURE_INSERT_QUERY, \
+    CATEGORY_CLOSURE_ROWS_QUERY, CATEGORY_ITEMS_QUERY, CATEGORY_PARENTS_QUERY, ITEM_CATEGORIES_QUERY
+from scripts.collaborative_filtering import NEIGHBOR_INSERT_QUERY, NEIGHBORS_DELETE_QUERIES, \
+    NEIGHBORS_FINGERPRINT_INSERT_QUERY, NEIGHBORS_QUERY, RATINGS_QUERY
+from scripts.content_based_algo import ITEMS_QUERY, SUBTREE_ITEMS_QUERY
+from scripts.interning import INTERNER_QUERIES
+from scripts.naive_algo import ITEM_RATINGS_QUERY
+from scripts.random_algo import ITEM_WEIGHTS_QUERY
+from scripts.relation_graph import ITEM_RELATIONS_QUERY
+from scripts.script_categories import CATEGORY_SIZES_QUERY
+from scripts.script_related_items import ITEM_IDS_QUERY, ITEM_TITLE_QUERY, ITEM_TITLES_QUERY, SAMPLE_ITEMS_QUERY
+from scripts.setup_db import ANY_RATING_AGGREGATE_QUERY, ANY_REVIEW_QUERY, CATEGORY_IDS_QUERY, \
+    CATEGORY_INSERT_QUERY, CHECKPOINT_QUERY, CHECKPOINT_UPSERT_QUERY, ITEM_CATEGORY_APPEND_QUERY, \
+    ITEM_CATEGORY_INSERT_QUERY, ITEM_INSERT_QUERY, ITEM_RATING_AGGREGATES_QUERY, ITEM_RELATED_APPEND_QUERY, \
+    ITEM_RELATED_INSERT_QUERY, LAST_REVIEW_ID_QUERY, NEW_RATINGS_QUERY, OVERALL_RATING_UPDATE_QUERY, \
+    RATING_AGGREGATE_FILL_QUERY, RATING_AGGREGATE_UPSERT_QUERY, RATING_AGGREGATES_QUERY, RELATED_CLEANUP_QUERY, \
+    REVIEW_APPEND_QUERY, REVIEW_INSERT_QUERY, USER_INSERT_QUERY
+from scripts.utils import CHECKPOINTS_STATE_QUERY, FINGERPRINT_TABLES, LAST_ROWID_QUERY, create_connection
+
+def placeholders(values: list) -> str:
+    return ",".join(["?"] * len(values))
+
+
+def get_samples(connection: Connection) -> dict:
+    # an item with a category which has a parent and with at least one relation, so every query has something to find
+    cursor = connection.execute("SELECT l.itemId, l.categoryId, c.parentCategoryId FROM item_category_list l "
+                                "JOIN category c ON c.id = l.categoryId "
+                                "WHERE c.parentCategoryId IS NOT NULL "
+                                "AND l.itemId IN (SELECT itemId FROM item_related_list) LIMIT 1")
+    item_id, category_id, parent_category_id = cursor.fetchone()
+
+    cursor = connection.execute("SELECT relatedItemId, relation FROM item_related_list WHERE itemId = ?", [item_id])
+    related = cursor.fetchall()
+
+    cursor = connection.execute("SELECT id FROM category WHERE parentCategoryId = ?", [parent_category_id])
+    category_siblings = [category[0] for category in cursor.fetchall()] + [parent_category_id]
+
+    cursor = connection.execute("SELECT userId, reviewTime FROM review WHERE itemId = ? LIMIT 1", [item_id])
+    user_id, review_time = cursor.fetchone()
+
+    cursor = connection.execute("SELECT filePath, fileSize, offset, finished FROM ingest_checkpoint LIMIT 1")
+    checkpoint = cursor.fetchone() or ("", 0, 0, False)
+
+    cursor = connection.execute("SELECT fingerprint FROM item_neighbor_fingerprint")
+    neighbors_fingerprint = cursor.fetchone()
+
+    return {
+        "item_id": item_id,
+        "category_id": category_id,
+        "parent_category_id": parent_category_id,
+        "category_siblings": category_siblings,
+        "related_item_id": related[0][0],
+        "relation": related[0][1],
+        "related_item_ids": [related_item_id for related_item_id, _ in related],
+        "user_id": user_id,
+        "review_time": review_time,
+        "checkpoint": list(checkpoint),
+        "neighbors_fingerprint": neighbors_fingerprint[0] if neighbors_fingerprint else ""
+    }
+
+
+# Every query from scripts/ and frontend/server.py with sample parameters, in format
+# (where it is used, query, parameters, whether a full scan is expected[, queries run before it]). The queries run
+# before a query are the statements its build step runs before it in the same transaction, e.g. the DELETE before
+# an INSERT which refills a table. Writes are rolled back after every run.
+def get_queries(samples: dict) -> list:
+    item_id = samples["item_id"]
+    category_id = samples["category_id"]
+    related_item_id = samples["related_item_id"]
+    related_item_ids = samples["related_item_ids"]
+    user_id = samples["user_id"]
+    review_time = samples["review_time"]
+
+    return [
+        ("random_algo.ItemSampler.refresh", ITEM_WEIGHTS_QUERY, [], True),
+        ("naive_algo.load_item_ratings", ITEM_RATINGS_QUERY, [], True),
+        ("naive_algo.recommend_products_by_category", ITEM_CATEGORIES_QUERY, [item_id], False),
+        ("category_rankings.get_category_ranking", RANKING_ITEMS_QUERY, ["siblings", samples["parent_category_id"]],
+         False),
+        ("content_based_algo.get_items", ITEMS_QUERY.format(placeholders(related_item_ids)), related_item_ids, False),
+        ("content_based_algo.find_similar_items_category", SUBTREE_ITEMS_QUERY, [item_id], False),
+        ("category_tree.build_category_closure", CATEGORY_CLOSURE_DELETE_QUERY, [], True),
+        ("category_tree.build_category_closure", CATEGORY_CLOSURE_INSERT_QUERY, [], True,
+         [CATEGORY_CLOSURE_DELETE_QUERY]),
+        ("category_rankings.build_category_rankings", RANKING_DELETE_QUERY, [], True),
+    ] + [
+        ("category_rankings.build_category_rankings", query, [RANKING_SIZE], True, [RANKING_DELETE_QUERY])
+        for query in RANKING_INSERT_QUERIES
+    ] + [
+        ("category_tree.CategoryTree.refresh", CATEGORY_PARENTS_QUERY, [], True),
+        ("category_tree.CategoryTree.refresh", CATEGORY_CLOSURE_ROWS_QUERY, [], True),
+        ("category_tree.CategoryTree.refresh", CATEGORY_ITEMS_QUERY, [], True),
+        ("collaborative_filtering.load_ratings", RATINGS_QUERY, [], True),
+        ("collaborative_filtering.get_precomputed_neighbors", NEIGHBORS_QUERY,
+         [item_id, samples["neighbors_fingerprint"], 10], False),
+    ] + [
+        ("collaborative_filtering.store_item_neighbors", query, [], True) for query in NEIGHBORS_DELETE_QUERIES
+    ] + [
+        ("collaborative_filtering.store_item_neighbors", NEIGHBORS_FINGERPRINT_INSERT_QUERY, ["[]"], False,
+         NEIGHBORS_DELETE_QUERIES),
+        ("collaborative_filtering.store_item_neighbors", NEIGHBOR_INSERT_QUERY, [item_id, 0, related_item_id, 0.5],
+         False, NEIGHBORS_DELETE_QUERIES),
+        ("relation_graph.RelationGraph.refresh", ITEM_RELATIONS_QUERY, [], True),
+    ] + [
+        ("interning.refresh_interners", query, [], True) for query in INTERNER_QUERIES.values()
+    ] + [
+        ("utils.get_db_fingerprint", LAST_ROWID_QUERY.format(table), [], False) for table in FINGERPRINT_TABLES
+    ] + [
+        ("utils.get_db_fingerprint", CHECKPOINTS_STATE_QUERY, [], True),
+        ("server.get_item_dict", ITEM_QUERY, [item_id], False),
+        ("server.feedback", FEEDBACK_INSERT_QUERY, [item_id, 4, 3, None, 2, 1, None, 4, 3, 2], False),
+        ("script_categories.categories_statistics", CATEGORY_SIZES_QUERY, [], True),
+        ("script_related_items.related_statistics", ITEM_IDS_QUERY, [], True),
+        ("script_related_items.check_symmetry", SAMPLE_ITEMS_QUERY, [100, 0], True),
+        ("script_related_items.get_relations", ITEM_TITLE_QUERY, [item_id], False),
+        ("script_related_items.get_titles", ITEM_TITLES_QUERY.format(placeholders(related_item_ids)),
+         related_item_ids, False),
+        ("setup_db.DBSetup.run", ANY_REVIEW_QUERY, [], True),
+        ("setup_db.DBSetup.prepare_append", ANY_RATING_AGGREGATE_QUERY, [], True),
+        ("setup_db.DBSetup.prepare_append", RATING_AGGREGATE_FILL_QUERY, [], True,
+         ["DELETE FROM item_rating_aggregate"]),
+        ("setup_db.DBSetup.get_checkpoint", CHECKPOINT_QUERY, samples["checkpoint"][:2], False),
+        ("setup_db.DBSetup.commit_batch", CHECKPOINT_UPSERT_QUERY, samples["checkpoint"], False),
+        ("setup_db.DBSetup.load_ratings_by_id", RATING_AGGREGATES_QUERY, [], True),
+        ("setup_db.DBSetup.update_rating_aggregates", RATING_AGGREGATE_UPSERT_QUERY, [item_id, 5, 1], False),
+        ("setup_db.DBSetup.update_rating_aggregates", ITEM_RATING_AGGREGATES_QUERY.format(
+            placeholders(related_item_ids)), related_item_ids, False),
+        ("setup_db.DBSetup.update_rating_aggregates", OVERALL_RATING_UPDATE_QUERY, [4.5, item_id], False),
+        ("setup_db.DBSetup.insert_review_batch", USER_INSERT_QUERY, [user_id, "benchmark"], False),
+        ("setup_db.DBSetup.insert_review_batch", LAST_REVIEW_ID_QUERY, [], False),
+        ("setup_db.DBSetup.insert_review_batch", REVIEW_INSERT_QUERY, [user_id, item_id, 5.0, review_time], False),
+        ("setup_db.DBSetup.insert_review_batch", REVIEW_APPEND_QUERY, [user_id, item_id, 5.0, review_time], False),
+        ("setup_db.DBSetup.insert_review_batch", NEW_RATINGS_QUERY, [0], False),
+        ("setup_db.DBSetup.get_category_id", CATEGORY_INSERT_QUERY,
+         [samples["parent_category_id"], "benchmark.category", "category"], False),
+        ("setup_db.DBSetup.insert_meta_batch", ITEM_INSERT_QUERY,
+         [item_id, "benchmark", "", 0.0, "", "", 0, 0.0], False),
+        ("setup_db.DBSetup.insert_meta_batch", ITEM_CATEGORY_INSERT_QUERY, [item_id, category_id], False),
+        ("setup_db.DBSetup.insert_meta_batch", ITEM_CATEGORY_APPEND_QUERY, [item_id, category_id], False),
+        ("setup_db.DBSetup.insert_meta_batch", ITEM_RELATED_INSERT_QUERY,
+         [item_id, related_item_id, samples["relation"]], False),
+        ("setup_db.DBSetup.insert_meta_batch", ITEM_RELATED_APPEND_QUERY,
+         [item_id, related_item_id, samples["relation"]], False),
+        ("setup_db.DBSetup.parse_meta_file", CATEGORY_IDS_QUERY, [], True),
+        ("setup_db.DBSetup.parse_meta_file", RELATED_CLEANUP_QUERY, [], True),
+    ]
+
+# tables which hold a single row, scanning them costs as much as a lookup
+SINGLE_ROW_TABLES = ["item_neighbor_fingerprint"]
+
+
+def get_full_scans(connection: Connection, query: str, parameters: list) -> list:
+    cursor = connection.execute("EXPLAIN QUERY PLAN " + query, parameters)
+    allowed = ["SCAN CONSTANT ROW"] + ["SCAN " + table for table in SINGLE_ROW_TABLES]
+    return [row[3] for row in cursor.fetchall() if row[3].startswith("SCAN ") and row[3] not in allowed]
+
+
+def benchmark(repeat: int) -> bool:
+    connection = create_connection()
+    queries = get_queries(get_samples(connection))
+    regressions = 0
+
+    for source, query, parameters, scan_expected, *prepare in queries:
+        full_scans = get_full_scans(connection, query, parameters)
+
+        took = 0
+        for _ in range(repeat):
+            for prepare_query in (prepare[0] if prepare else []):
+                connection.execute(prepare_query)
+            t0 = time.time()
+            connection.execute(query, parameters).fetchall()
+            took += time.time() - t0
+            connection.rollback()
+        took /= repeat
+
+        if full_scans and not scan_expected:
+            regressions += 1
+            status = "FULL SCAN"
+        else:
+            status = "ok"
+
+        print("{:10} {:8.2f} ms  {}".format(status, took * 1000, source))
+        query = " ".join(query.split())
+        print("           {}".format(query if len(query) <= 100 else query[:97] + "..."))
+        for full_scan in full_scans:
+            print("           - {}".format(full_scan))
+
+    connection.close()
+
+    print("Queries: {}, unexpected full scans: {}".format(len(queries), regressions))
+    return regressions == 0
+
+
+# run after setup_db.py, exits with 1 if any query which should use an index does a full scan
+# e.g. python3 scripts/benchmark_queries.py --repeat 10
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="This is a number of runs of each query its time is averaged over.")
+    args = parser.parse_args()
+
+    sys.exit(0 if benchmark(args.repeat) else 1)
@@ -0,0 +1,72 @@
+import argparse
+from datetime import datetime
+from sqlite3 import Connection
+
+from scripts.utils import create_connection
+
+# number of the best rated items stored for every group, the naive algorithms take 20 of them without the given item
+RANKING_SIZE = 21
+
+# rows of category_ranking of every category (groupType 'category', groupId is the category), the parameter is the size
+CATEGORY_RANKING_QUERY = '''
+    SELECT 'category', categoryId, rank, itemId, overallRating FROM (
+        SELECT categories.categoryId, categories.itemId, item.overallRating,
+               ROW_NUMBER() OVER (PARTITION BY categories.categoryId
+                                  ORDER BY item.overallRating DESC, categories.itemId) AS rank
+        FROM (SELECT DISTINCT categoryId, itemId FROM item_category_list) categories
+        JOIN item ON item.id = categories.itemId
+    )
+    WHERE rank <= ?
+'''
+# rows of category_ranking of every sibling group (groupType 'siblings', groupId is the parent, the group are its
+# children and the parent itself), the parameter is the size
+SIBLINGS_RANKING_QUERY = '''
+    WITH sibling_group(groupId, categoryId) AS (
+        SELECT parentCategoryId, id FROM category WHERE parentCategoryId IS NOT NULL
+        UNION
+        SELECT parentCategoryId, parentCategoryId FROM category WHERE parentCategoryId IS NOT NULL
+    )
+    SELECT 'siblings', groupId, rank, itemId, overallRating FROM (
+        SELECT groups.groupId, groups.itemId, item.overallRating,
+               ROW_NUMBER() OVER (PARTITION BY groups.groupId
+                                  ORDER BY item.overallRating DESC, groups.itemId) AS rank
+        FROM (SELECT DISTINCT sibling_group.groupId, item_category_list.itemId FROM sibling_group
+              JOIN item_category_list ON item_category_list.categoryId = sibling_group.categoryId) groups
+        JOIN item ON item.id = groups.itemId
+    )
+    WHERE rank <= ?
+'''
+RANKING_DELETE_QUERY = "DELETE FROM category_ranking"
+RANKING_INSERT_QUERIES = ["INSERT INTO category_ranking(groupType, groupId, rank, itemId, rating) " + query
+                          for query in [CATEGORY_RANKING_QUERY, SIBLINGS_RANKING_QUERY]]
+RANKING_ITEMS_QUERY = "SELECT itemId FROM category_ranking WHERE groupType=(?) AND groupId=(?) ORDER BY rank"
+
+
+# Fill category_ranking with the best rated items of every category and of every sibling group. Run it after the data
+# are loaded, the rankings change only then.
+def build_category_rankings(connection: Connection, size: int = RANKING_SIZE):
+    connection.execute(RANKING_DELETE_QUERY)
+    for query in RANKING_INSERT_QUERIES:
+        connection.execute(query, [size])
+    connection.commit()
+
+
+# Return ids of the best rated items of the group from the best one.
+def get_category_ranking(connection: Connection, group_type: str, group_id: int) -> list:
+    cursor = connection.execute(RANKING_ITEMS_QUERY, (group_type, group_id))
+    return [item[0] for item in cursor.fetchall()]
+
+
+# run after setup_db.py (it builds the rankings too) to build them again on demand
+# e.g. python3 scripts/category_rankings.py --size 21
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--size", type=int, default=RANKING_SIZE,
+                        help="This is a number of the best rated items stored for every category and sibling group.")
+    args = parser.parse_args()
+
+    start_time = datetime.now()
+    connection = create_connection()
+    build_category_rankings(connection, args.size)
+    connection.close()
+    print("DONE - Script execution took: {}".format(datetime.now() - start_time))
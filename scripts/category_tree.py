@@ -0,0 +1,123 @@
+from sqlite3 import Connection
+
+import numpy as np
+
+from scripts.interning import get_item_interner
+from scripts.utils import DBChangeCache, create_connection
+
+# all (ancestor, descendant, distance) pairs of the category hierarchy, including (category, category, 0)
+CATEGORY_CLOSURE_QUERY = '''
+    WITH RECURSIVE closure(ancestorId, descendantId, depth) AS (
+        SELECT id, id, 0 FROM category
+        UNION ALL
+        SELECT closure.ancestorId, category.id, closure.depth + 1
+        FROM closure JOIN category ON category.parentCategoryId = closure.descendantId
+    )
+    SELECT ancestorId, descendantId, depth FROM closure
+'''
+CATEGORY_CLOSURE_DELETE_QUERY = "DELETE FROM category_closure"
+CATEGORY_CLOSURE_INSERT_QUERY = ("INSERT INTO category_closure(ancestorId, descendantId, depth) "
+                                 + CATEGORY_CLOSURE_QUERY)
+CATEGORY_PARENTS_QUERY = "SELECT id, parentCategoryId FROM category"
+CATEGORY_CLOSURE_ROWS_QUERY = "SELECT ancestorId, descendantId, depth FROM category_closure"
+# categories of an item
+ITEM_CATEGORIES_QUERY = "SELECT categoryId FROM item_category_list WHERE itemId=(?)"
+
+# items of categories, they are read once per tree so that items of a category need no query
+CATEGORY_ITEMS_QUERY = "SELECT categoryId, itemId FROM item_category_list"
+
+
+# Fill category_closure with CATEGORY_CLOSURE_QUERY, so a whole subtree is one indexed lookup.
+def build_category_closure(connection: Connection):
+    connection.execute(CATEGORY_CLOSURE_DELETE_QUERY)
+    connection.execute(CATEGORY_CLOSURE_INSERT_QUERY)
+    connection.commit()
+
+
+class CategoryTree:
+    # {id -> parent id or None}
+    parent: dict
+    # {id -> [child id]}, root categories are children of None
+    children: dict
+    # {id -> [descendant id]}, including the category itself
+    descendants: dict
+    # {id -> distance from the root}
+    depth: dict
+    # interned codes of items of categories in CSR format, codes of items of the category with id c are at positions
+    # item_indptr[c]:item_indptr[c + 1] of item_codes, sorted and each once
+    item_indptr: np.ndarray
+    item_codes: np.ndarray
+
+    def __init__(self):
+        self.refresh()
+
+    # Load the hierarchy and items of categories from DB again, call when the DB changes.
+    def refresh(self):
+        connection = create_connection()
+
+        with connection:
+            self.parent = {}
+            self.children = {}
+            for category_id, parent_category_id in connection.execute(CATEGORY_PARENTS_QUERY):
+                self.parent[category_id] = parent_category_id
+                self.children.setdefault(parent_category_id, []).append(category_id)
+
+            self.descendants = {}
+            self.depth = {}
+            for ancestor_id, descendant_id, depth in connection.execute(CATEGORY_CLOSURE_ROWS_QUERY):
+                self.descendants.setdefault(ancestor_id, []).append(descendant_id)
+                if depth > self.depth.get(descendant_id, -1):
+                    self.depth[descendant_id] = depth
+
+            rows = connection.execute(CATEGORY_ITEMS_QUERY).fetchall()
+
+        connection.close()
+
+        # items new in DB are interned by now, items of unknown categories or unknown items are left out
+        codes = get_item_interner(reload=True).encode([row[1] for row in rows])
+        category_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        n_categories = max(self.parent, default=-1) + 1
+        known = (codes >= 0) & (category_ids >= 0) & (category_ids < n_categories)
+        codes, category_ids = codes[known], category_ids[known]
+
+        # an item listed in a category several times is there once
+        order = np.lexsort((codes, category_ids))
+        codes, category_ids = codes[order], category_ids[order]
+        unique = np.ones(len(codes), dtype=bool)
+        unique[1:] = (codes[1:] != codes[:-1]) | (category_ids[1:] != category_ids[:-1])
+        self.item_codes = codes[unique]
+        self.item_indptr = np.zeros(n_categories + 1, dtype=np.int64)
+        np.cumsum(np.bincount(category_ids[unique], minlength=n_categories), out=self.item_indptr[1:])
+
+    # Return positions of items of the category in item_codes as (start, end).
+    def get_item_range(self, category_id: int) -> tuple:
+        if not 0 <= category_id < len(self.item_indptr) - 1:
+            return 0, 0
+        return int(self.item_indptr[category_id]), int(self.item_indptr[category_id + 1])
+
+    def get_item_count(self, category_id: int) -> int:
+        start, end = self.get_item_range(category_id)
+        return end - start
+
+    def get_item_codes(self, category_id: int) -> np.ndarray:
+        start, end = self.get_item_range(category_id)
+        return self.item_codes[start:end]
+
+    def get_descendants(self, category_id: int) -> list:
+        return self.descendants.get(category_id, [category_id])
+
+    # Return the categories with the same parent (including the given one) and the parent itself. Root categories
+    # have no siblings.
+    def get_siblings(self, category_id: int) -> list:
+        parent_category_id = self.parent.get(category_id)
+        if parent_category_id is None:
+            return []
+
+        return self.children[parent_category_id] + [parent_category_id]
+
+
+_category_tree = DBChangeCache(CategoryTree)
+
+
+def get_category_tree() -> CategoryTree:
+    return _category_tree.get()
@@ -1,11 +1,238 @@
+import glob
+import json
 import os
+import shutil
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
+import numpy as np
 import pandas as pd
-from scipy.sparse import csr_matrix
+from scipy.sparse import coo_matrix, csr_matrix, diags
 from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
 
-from scripts.utils import create_connection
+from scripts.interning import get_item_interner, get_user_interner, refresh_interners
+from scripts.utils import DBChangeCache, create_connection, get_db_fingerprint, lock_file
+
+MODEL_PATH = "data/cf_model"
+RATINGS_QUERY = "SELECT itemId, userId, rating FROM review"
+NEIGHBORS_DELETE_QUERIES = ["DELETE FROM item_neighbor", "DELETE FROM item_neighbor_fingerprint"]
+NEIGHBORS_FINGERPRINT_INSERT_QUERY = "INSERT INTO item_neighbor_fingerprint(fingerprint) VALUES (?)"
+NEIGHBOR_INSERT_QUERY = "INSERT INTO item_neighbor(itemId, rank, neighborItemId, similarity) VALUES (?, ?, ?, ?)"
+# neighbors of an item, only if they were computed from data with the given fingerprint
+NEIGHBORS_QUERY = ("SELECT neighborItemId FROM item_neighbor WHERE itemId=(?) "
+                   "AND (SELECT fingerprint FROM item_neighbor_fingerprint) = (?) ORDER BY rank LIMIT ?")
+
+
+class CosineIndex:
+    """
+    This is an exact brute force nearest neighbors index by cosine
+    distance with the interface of sklearn.neighbors.NearestNeighbors.
+    Unlike NearestNeighbors, which copies the fitted sparse matrix, it
+    keeps the item-user matrix and norms of its rows as they are given,
+    so a memory-mapped model artifact stays shared between processes.
+    """
+
+    def __init__(self, n_neighbors=10):
+        self.n_neighbors = n_neighbors
+
+    def set_params(self, **params):
+        for key, value in params.items():
+            setattr(self, key, value)
+        return self
+
+    def fit(self, data, norms=None):
+        self.data = data
+        self.norms = np.sqrt(np.asarray(data.multiply(data).sum(axis=1)).ravel()) if norms is None else norms
+        return self
+
+    def kneighbors(self, X, n_neighbors=None):
+        """
+        return cosine distances and row indices of n nearest neighbors
+        of rows of X, as sklearn NearestNeighbors.kneighbors
+        """
+        n_neighbors = n_neighbors or self.n_neighbors
+        tiny = np.finfo(np.float64).tiny
+        query_norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+
+        similarities = (X @ self.data.T).toarray()
+        similarities /= np.maximum(query_norms, tiny)[:, None]
+        similarities /= np.maximum(self.norms, tiny)[None, :]
+        distances = 1 - similarities
+
+        indices = np.argpartition(distances, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        distances = np.take_along_axis(distances, indices, axis=1)
+        order = np.argsort(distances, axis=1, kind='stable')
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class LshIndex:
+    """
+    This is an approximate nearest neighbors index by cosine distance
+    with random hyperplane LSH, it has the interface of
+    sklearn.neighbors.NearestNeighbors used by KnnRecommender.
+    Items whose L2 normalized vectors are on the same sides of n_bits
+    random hyperplanes share a bucket in each of n_tables tables,
+    candidates from the buckets of a query are ranked by exact cosine
+    distance.
+    A neighbor with cosine similarity s to a query is on the same side of
+    a hyperplane with probability p = 1 - arccos(s) / pi and shares a
+    bucket of some table with probability 1 - (1 - p^n_bits)^n_tables.
+    Unless n_bits is given, fit derives it from the data: the largest
+    n_bits whose probability for the n-th neighbor similarity of sampled
+    items is at least target_recall, at most log2(n_items / n_neighbors)
+    so that buckets are not smaller than n_neighbors. More bits mean
+    smaller buckets and faster queries, fewer bits mean higher recall.
+    Measured by scripts/benchmark_ann.py on a test catalogue of 1801
+    items and 16 tables, recall@10 was 0.11 with n_bits=8 and 0.94 with
+    the derived n_bits=3.
+    """
+
+    def __init__(self, n_neighbors=10, n_tables=16, n_bits=None, random_state=0, target_recall=0.9,
+                 n_samples=100):
+        self.n_neighbors = n_neighbors
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.random_state = random_state
+        self.target_recall = target_recall
+        self.n_samples = n_samples
+
+    def set_params(self, **params):
+        for key, value in params.items():
+            setattr(self, key, value)
+        return self
+
+    def _hash(self, data):
+        """
+        return codes of buckets of rows of data, one column per table
+        """
+        above = np.asarray(data @ self.hyperplanes) > 0
+        above = above.reshape(data.shape[0], self.n_tables, self.n_bits_)
+        return above.dot(1 << np.arange(self.n_bits_))
+
+    def _derive_n_bits(self, random_state):
+        """
+        return the number of bits per table expected to find the n-th
+        nearest neighbor of a typical item with probability target_recall
+        """
+        n_items = self.data.shape[0]
+        max_bits = max(1, int(np.log2(max(n_items / self.n_neighbors, 1))))
+        if n_items <= self.n_neighbors:
+            return max_bits
+
+        samples = random_state.choice(n_items, min(self.n_samples, n_items), replace=False)
+        similarities = (self.data[samples] @ self.data.T).toarray()
+        similarities[np.arange(len(samples)), samples] = -np.inf
+        # similarity of the n-th neighbor of a median sampled item
+        nth = np.median(-np.partition(-similarities, self.n_neighbors - 1, axis=1)[:, self.n_neighbors - 1])
+        p = 1 - np.arccos(np.clip(nth, -1, 1)) / np.pi
+
+        for n_bits in range(max_bits, 1, -1):
+            if 1 - (1 - p ** n_bits) ** self.n_tables >= self.target_recall:
+                return n_bits
+        return 1
+
+    def fit(self, data):
+        self.data = normalize(data, norm='l2', axis=1).tocsr()
+        random_state = np.random.RandomState(self.random_state)
+        # number of bits of the fitted tables
+        self.n_bits_ = self._derive_n_bits(random_state) if self.n_bits is None else self.n_bits
+        self.hyperplanes = random_state.standard_normal(
+            (data.shape[1], self.n_tables * self.n_bits_)).astype(np.float32)
+
+        # items of each table sorted by their codes, a bucket is a range found by binary search
+        codes = self._hash(self.data)
+        self.order = np.argsort(codes, axis=0, kind='stable')
+        self.sorted_codes = np.take_along_axis(codes, self.order, axis=0)
+        return self
+
+    def _candidates(self, codes):
+        """
+        return row indices of items sharing a bucket with a query
+        whose bucket codes are given, one per table
+        """
+        candidates = []
+        for table, code in enumerate(codes):
+            sorted_codes = self.sorted_codes[:, table]
+            start, end = np.searchsorted(sorted_codes, [code, code + 1])
+            candidates.append(self.order[start:end, table])
+        return np.unique(np.concatenate(candidates))
+
+    def kneighbors(self, X, n_neighbors=None):
+        """
+        return cosine distances and row indices of approximate n nearest
+        neighbors of rows of X, as sklearn NearestNeighbors.kneighbors
+        """
+        n_neighbors = n_neighbors or self.n_neighbors
+        queries = normalize(X, norm='l2', axis=1).tocsr()
+        distances = np.empty((queries.shape[0], n_neighbors))
+        indices = np.empty((queries.shape[0], n_neighbors), dtype=np.int64)
+
+        for i, codes in enumerate(self._hash(queries)):
+            candidates = self._candidates(codes)
+            if len(candidates) < n_neighbors:
+                # probe also buckets differing in one bit
+                flipped = codes[:, None] ^ (1 << np.arange(self.n_bits_))[None, :]
+                candidates = np.unique(np.concatenate(
+                    [candidates] + [self._candidates(column) for column in flipped.T]))
+            if len(candidates) < n_neighbors:
+                candidates = np.arange(self.data.shape[0])
+
+            similarities = np.asarray((self.data[candidates] @ queries[i].T).todense()).ravel()
+            top = np.argsort(-similarities, kind='stable')[:n_neighbors]
+            distances[i] = 1 - similarities[top]
+            indices[i] = candidates[top]
+
+        return distances, indices
+
+
+class ItemRatingStats:
+    """
+    This is per-item rating statistics as numpy arrays aligned with
+    rows of the item-user matrix, so that ranking of items is an array gather
+    """
+    ARRAYS = ['count', 'mean', 'variance', 'bayesian_mean']
+
+    def __init__(self, item_user_mat_sparse, prior_weight=None):
+        """
+        Parameters
+        ----------
+        item_user_mat_sparse: item-user scipy sparse matrix of ratings
+        prior_weight: float, number of global mean ratings the bayesian
+            mean is shrunk with, default is the mean number of ratings per item
+        """
+        ratings = item_user_mat_sparse.tocsr()
+        sums = np.asarray(ratings.sum(axis=1)).ravel()
+        squares = np.asarray(ratings.multiply(ratings).sum(axis=1)).ravel()
+
+        self.count = np.diff(ratings.indptr)
+        self.mean = sums / np.maximum(self.count, 1)
+        self.variance = np.maximum(squares / np.maximum(self.count, 1) - self.mean ** 2, 0)
+
+        self.global_mean = sums.sum() / max(self.count.sum(), 1)
+        self.prior_weight = self.count.mean() if prior_weight is None else prior_weight
+        self.bayesian_mean = (self.prior_weight * self.global_mean + sums) / (self.prior_weight + self.count)
+
+    def save(self, path):
+        """
+        save statistics as .npy files into directory path
+        """
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, 'stats_{}.npy'.format(name)), getattr(self, name))
+        np.save(os.path.join(path, 'stats_scalars.npy'), np.array([self.global_mean, self.prior_weight]))
+
+    @classmethod
+    def load(cls, path):
+        """
+        load statistics saved into directory path, arrays are memory-mapped
+        """
+        stats = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(stats, name, np.load(os.path.join(path, 'stats_{}.npy'.format(name)), mmap_mode='r'))
+        stats.global_mean, stats.prior_weight = np.load(os.path.join(path, 'stats_scalars.npy')).tolist()
+        return stats
 
 
 class KnnRecommender:
@@ -14,99 +241,226 @@ class KnnRecommender:
     KNN implmented by sklearn
     """
 
-    def __init__(self):
-        self.model = NearestNeighbors()
-        self.item_user_mat_sparse, self.hashmap = self._prep_data()
+    def __init__(self, artifact_path=None):
+        """
+        Parameters
+        ----------
+        artifact_path: string, optional, path of a model artifact, it is
+            loaded if it was built from the current data of DB, otherwise
+            data are prepared from DB and saved there
+        """
+        self.model = CosineIndex()
+        self.artifact_path = artifact_path
+        # the pointer is read once, all files are loaded from the same version of the artifact
+        version_path = self.get_version_path(artifact_path) if artifact_path else None
+        if version_path and self._is_current(version_path):
+            self._load(version_path)
+        else:
+            self._set_data_from_db()
+            if artifact_path:
+                self.save(artifact_path)
         self.set_model_params(10, 'brute', 'cosine', -1)
 
-    def set_model_params(self, n_neighbors, algorithm, metric, n_jobs=None):
+    def refresh(self):
+        """
+        reload item-user matrix from DB, save it as the artifact
+        and fit the model again, call it when reviews in DB change
+        """
+        self._set_data_from_db()
+        if self.artifact_path:
+            self.save(self.artifact_path)
+        self._fit()
+
+    def _set_data_from_db(self):
+        # the fingerprint is read before the data, so changes made meanwhile make the artifact stale, not lost
+        self.fingerprint = np.array(get_db_fingerprint(), dtype=np.int64)
+        self._set_data(*self._prep_data())
+
+    @staticmethod
+    def get_version_path(path):
+        """
+        return the directory of the version of the artifact published by
+        the pointer file path, artifacts of former versions are the directory
+        path itself
+        """
+        if os.path.isfile(path):
+            with open(path) as pointer:
+                return os.path.join(os.path.dirname(os.path.abspath(path)), pointer.read().strip())
+        return path
+
+    @staticmethod
+    def _is_current(path):
+        """
+        return whether the artifact in directory path exists and was built
+        from the current data of DB, artifacts of former versions have
+        no fingerprint and are stale
+        """
+        fingerprint_path = os.path.join(path, 'fingerprint.npy')
+        return os.path.exists(os.path.join(path, 'item_codes.npy')) and os.path.exists(fingerprint_path) and \
+            np.load(fingerprint_path).tolist() == get_db_fingerprint()
+
+    def _set_data(self, item_user_mat_sparse, item_codes, stats=None, norms=None):
+        self.item_user_mat_sparse = item_user_mat_sparse
+        # interned code of item of every row of item-user matrix
+        self.item_codes = item_codes
+        # the artifact may be saved by another process with codes newer than the interner of this one
+        if len(item_codes) and item_codes.max() >= len(get_item_interner()):
+            get_item_interner(reload=True)
+        # row index in item-user matrix of every interned item code
+        self.rows_by_code = get_rows_by_code(item_codes)
+        self.stats = ItemRatingStats(item_user_mat_sparse) if stats is None else stats
+        # L2 norms of rows of item-user matrix
+        self.norms = np.sqrt(np.asarray(item_user_mat_sparse.multiply(item_user_mat_sparse).sum(axis=1)).ravel()) \
+            if norms is None else norms
+
+    def _fit(self):
+        if isinstance(self.model, CosineIndex):
+            self.model.fit(self.item_user_mat_sparse, self.norms)
+        else:
+            self.model.fit(self.item_user_mat_sparse)
+
+    def save(self, path):
+        """
+        save CSR arrays of item-user matrix, interned item codes, norms of rows,
+        rating statistics and the DB fingerprint as .npy files into a new
+        version directory next to path and publish it by replacing pointer
+        file path, which holds the name of the directory, at once; the files
+        are loaded memory-mapped, so all processes loading the artifact share
+        one copy of it in the page cache
+        """
+        path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # every save writes into its own directory, concurrent saves do not mix their files
+        tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + '.tmp.', dir=os.path.dirname(path))
+        # mkdtemp makes it readable by the owner only
+        os.chmod(tmp_path, 0o755)
+        arrays = {
+            'data': self.item_user_mat_sparse.data,
+            'indices': self.item_user_mat_sparse.indices,
+            'indptr': self.item_user_mat_sparse.indptr,
+            'shape': np.array(self.item_user_mat_sparse.shape),
+            'item_codes': self.item_codes,
+            'norms': self.norms,
+            'fingerprint': self.fingerprint
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        self.stats.save(tmp_path)
+
+        # publishing and removal of old versions are serialized between processes, so a version is never removed
+        # before it is published
+        with lock_file(path + '.lock'):
+            version_path = os.path.join(os.path.dirname(path),
+                                        os.path.basename(tmp_path).replace('.tmp.', '.v', 1))
+            os.rename(tmp_path, version_path)
+            previous_path = os.path.realpath(self.get_version_path(path))
+            if os.path.isdir(path) and not os.path.islink(path):
+                # artifact of a former version is a plain directory
+                shutil.rmtree(path)
+
+            # the pointer is replaced at once, processes loading the artifact see either the old or the new version
+            pointer_path = version_path + '.pointer'
+            with open(pointer_path, 'w') as pointer:
+                pointer.write(os.path.basename(version_path))
+            os.replace(pointer_path, path)
+
+            # the replaced version is kept for processes which are just loading it, older ones are removed; processes
+            # which loaded them keep their mapping of the removed files (where the OS lets them be removed)
+            for old_path in glob.glob(glob.escape(path) + '.v*'):
+                if os.path.realpath(old_path) not in (os.path.realpath(version_path), previous_path) and \
+                        os.path.isdir(old_path):
+                    shutil.rmtree(old_path, ignore_errors=True)
+
+    def _load(self, path):
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        item_user_mat_sparse = csr_matrix((load('data'), load('indices'), load('indptr')),
+                                          shape=tuple(load('shape').tolist()), copy=False)
+        self.fingerprint = load('fingerprint')
+        self._set_data(item_user_mat_sparse, load('item_codes'), ItemRatingStats.load(path), load('norms'))
+
+    def set_model_params(self, n_neighbors, algorithm, metric, n_jobs=None, **lsh_params):
         """
-        set model params for sklearn.neighbors.NearestNeighbors
+        set model params for sklearn.neighbors.NearestNeighbors,
+        brute force with cosine metric uses CosineIndex instead, which
+        does not copy the (memory-mapped) item-user matrix,
+        approximate LshIndex is used with algorithm 'lsh'
         Parameters
         ----------
         n_neighbors: int, optional (default = 5)
-        algorithm: {'auto', 'ball_tree', 'kd_tree', 'brute'}, optional
+        algorithm: {'auto', 'ball_tree', 'kd_tree', 'brute', 'lsh'}, optional
         metric: string or callable, default 'minkowski', or one of
-            ['cityblock', 'cosine', 'euclidean', 'l1', 'l2', 'manhattan']
+            ['cityblock', 'cosine', 'euclidean', 'l1', 'l2', 'manhattan'],
+            'lsh' supports only 'cosine'
         n_jobs: int or None, optional (default=None)
+        lsh_params: n_tables, n_bits, random_state and target_recall of LshIndex
         """
-        if n_jobs and (n_jobs > 1 or n_jobs == -1):
-            os.environ['JOBLIB_TEMP_FOLDER'] = '/tmp'
-        self.model.set_params(**{
-            'n_neighbors': n_neighbors,
-            'algorithm': algorithm,
-            'metric': metric,
-            'n_jobs': n_jobs})
+        if algorithm == 'lsh':
+            if metric != 'cosine':
+                raise Exception("Algorithm 'lsh' supports only 'cosine' metric.")
+            self.model = LshIndex(n_neighbors=n_neighbors, **lsh_params)
+        elif algorithm == 'brute' and metric == 'cosine':
+            self.model = CosineIndex(n_neighbors=n_neighbors)
+        else:
+            if not isinstance(self.model, NearestNeighbors):
+                self.model = NearestNeighbors()
+            if n_jobs and (n_jobs > 1 or n_jobs == -1):
+                os.environ['JOBLIB_TEMP_FOLDER'] = '/tmp'
+            self.model.set_params(**{
+                'n_neighbors': n_neighbors,
+                'algorithm': algorithm,
+                'metric': metric,
+                'n_jobs': n_jobs})
+        # fit only once here, not with every inference
+        self._fit()
 
     def _prep_data(self):
         """
         prepare data for recommender
         1. item-user scipy sparse matrix
-        2. hashmap of itemId to row index in item-user scipy sparse matrix
-        """
-        connection = create_connection()
-
-        with connection:
-            # read data
-            cursor = connection.cursor()
-            cursor.execute("SELECT * FROM review")
-            reviews = cursor.fetchall()
-            cursor.close()
-
-            columns = ['id', 'userId', 'itemId', 'rating', 'reviewTime']
-            df_ratings = pd.DataFrame(reviews, columns=columns)
-            # pivot and create movie-user matrix
-            item_user_mat = df_ratings.pivot(
-                index='itemId', columns='userId', values='rating').fillna(0)
-            # hashmap of itemId to row index in item-user scipy sparse matrix
-            hashmap = {}
-            index = 0
-            for i in item_user_mat.index:
-                hashmap[index] = i
-                index = index + 1
-
-            # transform matrix to scipy sparse matrix
-            item_user_mat_sparse = csr_matrix(item_user_mat.values)
-
-            # clean up
-            del df_ratings, item_user_mat
-            return item_user_mat_sparse, hashmap
+        2. interned item code of every row of item-user scipy sparse matrix
+        """
+        df_ratings = load_ratings()
+
+        refresh_interners()
+        item_codes = get_item_interner().encode(df_ratings['itemId'].values)
+        user_codes = get_user_interner().encode(df_ratings['userId'].values)
+        # rows are reviewed items in order of their codes, columns are interned codes of users
+        row_item_codes, item_index = np.unique(item_codes, return_inverse=True)
+
+        # build sparse item-user matrix straight from (item, user, rating) triples,
+        # without the dense pivot its memory is proportional to the number of reviews
+        item_user_mat_sparse = coo_matrix(
+            (df_ratings['rating'].values.astype(np.float64), (item_index, user_codes)),
+            shape=(len(row_item_codes), len(get_user_interner()))).tocsr()
+
+        # clean up
+        del df_ratings
+        return item_user_mat_sparse, row_item_codes.astype(np.int32)
 
     def _inference(self, model, data,
-                   itemId, n_recommendations):
+                   itemIds, n_recommendations):
         """
-        return top n similar item recommendations
+        return top n similar item recommendations for several items at once
         Parameters
         ----------
-        model: sklearn model, knn model
+        model: sklearn model, knn model fitted on data
         data: item-user matrix
-        itemId: id of item in matrix
+        itemIds: list of ids of items in matrix
         n_recommendations: int, top n recommendations
         Return
         ------
-        list of top n similar item recommendations
+        array of ids in matrix of top n similar items for every item,
+        sorted from the most similar
         """
-        # fit
-        model.fit(data)
-
-        # inference
+        # inference of all items with one call
         distances, indices = model.kneighbors(
-            data[itemId],
+            data[itemIds],
             n_neighbors=n_recommendations + 1)
-        # get list of raw idx of recommendations
-        raw_recommends = \
-            sorted(
-                list(
-                    zip(
-                        indices.squeeze().tolist(),
-                        distances.squeeze().tolist()
-                    )
-                ),
-                key=lambda x: x[1]
-            )[:0:-1]
-
-        # return recommendation (itemId, distance)
-        return raw_recommends
+        # sort by distance and skip the nearest one, it is the item itself
+        order = np.argsort(distances, axis=1, kind='stable')
+        return np.take_along_axis(indices, order, axis=1)[:, 1:]
 
     def make_recommendations(self, itemId, n_recommendations):
         """
@@ -116,38 +470,267 @@ class KnnRecommender:
         itemId: raw id of item
         n_recommendations: int, top n recommendations
         """
-        reverse_hashmap = {v: k for k, v in self.hashmap.items()}
-        idx = reverse_hashmap[itemId]
-        # get recommendation
+        return self.make_recommendations_batch([itemId], n_recommendations)[itemId]
+
+    def make_recommendations_batch(self, itemIds, n_recommendations):
+        """
+        make top n recommendations for several items with one model call
+        Parameters
+        ----------
+        itemIds: list of raw ids of items
+        n_recommendations: int, top n recommendations
+        Return
+        ------
+        dict of raw id of item to list of its recommended raw ids of items
+        """
+        rows = get_rows(self.rows_by_code, itemIds)
         raw_recommends = self._inference(
             self.model, self.item_user_mat_sparse,
-            idx, n_recommendations)
-        # print results
-        recommended_item_id = []
-        # print('Recommendations for {}:'.format(itemId))
-        for i, (idx, dist) in enumerate(raw_recommends):
-            # print('{0}: {1}, with distance '
-            #       'of {2}'.format(i + 1, self.hashmap[idx], dist))
-            recommended_item_id.insert(0, self.hashmap[idx])
-        del raw_recommends
-        return recommended_item_id
+            rows, n_recommendations)
 
+        return {itemId: get_item_interner().decode(self.item_codes[recommends])
+                for itemId, recommends in zip(itemIds, raw_recommends)}
 
-def get_mean_per_item_list():
+
+class AlsRecommender:
+    """
+    This is an item-based collaborative filtering recommender with item
+    and user factors trained by implicit feedback alternating least
+    squares (Hu, Koren, Volinsky), similar items are found by dot
+    products of L2 normalized dense item factors
+    """
+
+    def __init__(self, item_user_mat_sparse, item_codes, factors=64, regularization=0.1, alpha=10.0,
+                 iterations=15, n_jobs=None, random_state=0):
+        """
+        Parameters
+        ----------
+        item_user_mat_sparse: item-user scipy sparse matrix of ratings
+        item_codes: array of interned code of item of every row of item-user matrix
+        factors: int, number of latent factors
+        regularization: float, L2 regularization of factors
+        alpha: float, confidence of a rating r is 1 + alpha * r
+        iterations: int, number of alternating updates of user and item factors
+        n_jobs: int or None, number of threads solving rows in parallel,
+            None means number of CPUs
+        random_state: int, seed of initial factors
+        """
+        self.item_user_mat_sparse = item_user_mat_sparse.tocsr()
+        self.item_codes = item_codes
+        self.rows_by_code = get_rows_by_code(item_codes)
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.random_state = random_state
+        self.fit()
+
+    def _solve(self, ratings, fixed_factors):
+        """
+        return factors of rows of ratings minimizing the confidence weighted
+        loss with the other side's factors fixed, each row is a small
+        least squares problem, chunks of rows are solved in parallel threads
+        (numpy releases GIL in linear algebra routines)
+        """
+        gram = fixed_factors.T @ fixed_factors
+        regularization = self.regularization * np.eye(self.factors)
+        solved = np.zeros((ratings.shape[0], self.factors))
+
+        def solve_rows(rows):
+            for row in rows:
+                start, end = ratings.indptr[row], ratings.indptr[row + 1]
+                if start == end:
+                    continue
+                factors = fixed_factors[ratings.indices[start:end]]
+                confidence = 1 + self.alpha * ratings.data[start:end]
+                # Y^T C Y = Y^T Y + Y^T (C - I) Y, only observed entries differ from the shared gram matrix
+                a = gram + (factors.T * (confidence - 1)) @ factors + regularization
+                solved[row] = np.linalg.solve(a, factors.T @ confidence)
+
+        chunks = np.array_split(np.arange(ratings.shape[0]), self.n_jobs)
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            list(executor.map(solve_rows, chunks))
+        return solved
+
+    def fit(self):
+        """
+        train item and user factors, call it again when the data change
+        """
+        random_state = np.random.RandomState(self.random_state)
+        item_user = self.item_user_mat_sparse
+        user_item = item_user.T.tocsr()
+        self.item_factors = random_state.normal(0, 0.01, (item_user.shape[0], self.factors))
+        self.user_factors = random_state.normal(0, 0.01, (item_user.shape[1], self.factors))
+
+        for _ in range(self.iterations):
+            self.user_factors = self._solve(user_item, self.item_factors)
+            self.item_factors = self._solve(item_user, self.user_factors)
+
+        norms = np.linalg.norm(self.item_factors, axis=1)
+        self.normalized_item_factors = self.item_factors / np.maximum(norms, np.finfo(np.float64).tiny)[:, None]
+
+    def make_recommendations(self, itemId, n_recommendations):
+        """
+        make top n recommendations
+        Parameters
+        ----------
+        itemId: raw id of item
+        n_recommendations: int, top n recommendations
+        """
+        return self.make_recommendations_batch([itemId], n_recommendations)[itemId]
+
+    def make_recommendations_batch(self, itemIds, n_recommendations):
+        """
+        make top n recommendations for several items at once
+        Parameters
+        ----------
+        itemIds: list of raw ids of items
+        n_recommendations: int, top n recommendations
+        Return
+        ------
+        dict of raw id of item to list of its recommended raw ids of items
+        """
+        rows = get_rows(self.rows_by_code, itemIds)
+        # cosine similarities of items to the whole catalogue
+        scores = self.normalized_item_factors[rows] @ self.normalized_item_factors.T
+        # an item is not its own recommendation
+        scores[np.arange(len(rows)), rows] = -np.inf
+
+        n_recommendations = min(n_recommendations, scores.shape[1] - 1)
+        top = np.argpartition(-scores, n_recommendations - 1, axis=1)[:, :n_recommendations]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+
+        return {itemId: get_item_interner().decode(self.item_codes[recommends])
+                for itemId, recommends in zip(itemIds, top)}
+
+
+def get_rows_by_code(item_codes):
+    """
+    return array of row index of every interned item code, -1 for items without a row
+    """
+    rows_by_code = np.full(int(item_codes.max()) + 1 if len(item_codes) else 0, -1, dtype=np.int32)
+    rows_by_code[item_codes] = np.arange(len(item_codes), dtype=np.int32)
+    return rows_by_code
+
+
+def get_rows(rows_by_code, itemIds):
+    """
+    return array of row indices of raw ids of items, KeyError for an item without a row
+    """
+    codes = get_item_interner().encode(itemIds)
+    known = (codes >= 0) & (codes < len(rows_by_code))
+    rows = np.where(known, rows_by_code[np.where(known, codes, 0)], -1)
+    if (rows < 0).any():
+        raise KeyError(itemIds[int(np.argmax(rows < 0))])
+    return rows
+
+
+def compute_item_neighbors(item_user_mat_sparse, n_neighbors, block_size=256, norms=None):
+    """
+    compute cosine top n neighbors of every item at once,
+    rows of the item-user matrix are multiplied block by block
+    Parameters
+    ----------
+    item_user_mat_sparse: item-user scipy sparse matrix
+    n_neighbors: int, number of neighbors of every item
+    block_size: int, number of items multiplied at once,
+        the dense block of similarities has block_size x n_items values
+    norms: array of L2 norms of rows, optional, computed if not given
+    Return
+    ------
+    generator of (row indices of items, row indices of their neighbors, similarities)
+    for every block, neighbors of an item are sorted from the most similar
+    """
+    n_items = item_user_mat_sparse.shape[0]
+    n_neighbors = min(n_neighbors, n_items - 1)
+    # cosine similarity is a dot product of L2 normalized rows
+    if norms is None:
+        normalized = normalize(item_user_mat_sparse, norm='l2', axis=1).tocsr()
+    else:
+        normalized = (diags(1 / np.maximum(norms, np.finfo(np.float64).tiny)) @ item_user_mat_sparse).tocsr()
+    normalized_t = normalized.T.tocsr()
+
+    for start in range(0, n_items, block_size):
+        end = min(start + block_size, n_items)
+        rows = np.arange(start, end)
+        similarities = (normalized[start:end] @ normalized_t).toarray()
+        # an item is not its own neighbor
+        similarities[rows - start, rows] = -np.inf
+
+        neighbors = np.argpartition(-similarities, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        neighbor_similarities = np.take_along_axis(similarities, neighbors, axis=1)
+        order = np.argsort(-neighbor_similarities, axis=1, kind='stable')
+
+        yield rows, np.take_along_axis(neighbors, order, axis=1), np.take_along_axis(neighbor_similarities, order, axis=1)
+
+
+def store_item_neighbors(recommender, n_neighbors, block_size=256):
+    """
+    precompute neighbors of every item of the recommender into item_neighbor table
+    together with the DB fingerprint of the data of the recommender,
+    collaboration_filtering reads them instead of running the model
+    while data in DB are the same
+    """
+    connection = create_connection()
+    item_ids = get_item_interner().decode(recommender.item_codes)
+
+    with connection:
+        for query in NEIGHBORS_DELETE_QUERIES:
+            connection.execute(query)
+        fingerprint = json.dumps(np.asarray(recommender.fingerprint).tolist())
+        connection.execute(NEIGHBORS_FINGERPRINT_INSERT_QUERY, [fingerprint])
+        for rows, neighbors, similarities in compute_item_neighbors(
+                recommender.item_user_mat_sparse, n_neighbors, block_size, recommender.norms):
+            connection.executemany(
+                NEIGHBOR_INSERT_QUERY,
+                [(item_ids[row], rank, item_ids[neighbor], similarity)
+                 for row, row_neighbors, row_similarities in zip(rows.tolist(), neighbors.tolist(),
+                                                                 similarities.tolist())
+                 for rank, (neighbor, similarity) in enumerate(zip(row_neighbors, row_similarities))])
+
+
+# fingerprint of the current data of DB, precomputed neighbors are used only if they were computed from the same data
+_db_fingerprint = DBChangeCache(lambda: json.dumps(get_db_fingerprint()))
+
+
+def get_precomputed_neighbors(itemId, n_recommendations):
+    """
+    return precomputed neighbors of the item from item_neighbor table,
+    empty list if there are not enough of them or if they were computed
+    from other data than the current data of DB
+    """
+    connection = create_connection()
+
+    with connection:
+        cursor = connection.execute(NEIGHBORS_QUERY, (itemId, _db_fingerprint.get(), n_recommendations))
+        neighbors = [item[0] for item in cursor.fetchall()]
+
+    return neighbors if len(neighbors) == n_recommendations else []
+
+
+def load_ratings():
+    """
+    read (itemId, userId, rating) triples of all reviews,
+    only the last rating of a user for an item is kept
+    """
     connection = create_connection()
 
     with connection:
         cursor = connection.cursor()
-        cursor.execute("SELECT * FROM review")
+        cursor.execute(RATINGS_QUERY)
         reviews = cursor.fetchall()
         cursor.close()
 
-        columns = ['id', 'userId', 'itemId', 'rating', 'reviewTime']
-        df_ratings = pd.DataFrame(reviews, columns=columns)
-        # pivot and create item-user matrix
-        item_user_mat = df_ratings.pivot(
-            index='itemId', columns='userId', values='rating')
-        return item_user_mat.mean(axis=1, skipna=True)
+    df_ratings = pd.DataFrame(reviews, columns=['itemId', 'userId', 'rating'])
+    return df_ratings.drop_duplicates(subset=['itemId', 'userId'], keep='last')
+
+
+def get_mean_per_item_list():
+    recommender = get_recommender()
+    item_ids = get_item_interner().decode(recommender.item_codes)
+    return pd.Series(recommender.stats.mean, index=item_ids)
 
 
 def hybrid_algorithm(itemId, n_recommendations):
@@ -161,19 +744,53 @@ def hybrid_algorithm(itemId, n_recommendations):
     # first parametr is id of item, second number of items to recommend
     recommended_item_id = collaboration_filtering(itemId, n_recommendations)
     #####
-    mean_per_item = get_mean_per_item_list()
-    item_id_with_highest_review_mean = recommended_item_id[0]
-    for itemId in recommended_item_id:
-        if mean_per_item[itemId] > mean_per_item[item_id_with_highest_review_mean]:
-            # print('new value for item_id_with_highest_review_mean', itemId, mean_per_item[itemId])
-            item_id_with_highest_review_mean = itemId
-    # print('best item id to recommend according to hybrid', item_id_with_highest_review_mean)
+    recommender = get_recommender()
+    rows = get_rows(recommender.rows_by_code, recommended_item_id)
+    # the first of recommended items with the highest mean rating
+    item_id_with_highest_review_mean = recommended_item_id[int(np.argmax(recommender.stats.mean[rows]))]
 
     return recommended_item_id[0], item_id_with_highest_review_mean
 
 
+_recommender = DBChangeCache(lambda: KnnRecommender(MODEL_PATH))
+_als_recommender = None
+_als_recommender_lock = Lock()
+
+
+def get_recommender():
+    """
+    return KnnRecommender shared by all calls in the process,
+    it is loaded from the artifact in MODEL_PATH (built from DB and saved
+    if it is missing or stale), and loaded again when data in DB change
+    """
+    return _recommender.get()
+
+
+def get_als_recommender():
+    """
+    return AlsRecommender shared by all calls in the process,
+    trained on the first call on data of the KnnRecommender and again
+    when the KnnRecommender is loaded again
+    """
+    global _als_recommender
+    recommender = get_recommender()
+    with _als_recommender_lock:
+        if _als_recommender is None or _als_recommender.item_codes is not recommender.item_codes:
+            _als_recommender = AlsRecommender(recommender.item_user_mat_sparse, recommender.item_codes)
+    return _als_recommender
+
+
+def collaboration_filtering_als(itemId, n_recommendations):
+    return get_als_recommender().make_recommendations(itemId, n_recommendations)
+
+
 def collaboration_filtering(itemId, n_recommendations):
-    recommender = KnnRecommender()
+    # neighbors precomputed by scripts/precompute_neighbors.py from the current data are just looked up
+    recommended_item_id = get_precomputed_neighbors(itemId, n_recommendations)
+    if recommended_item_id:
+        return recommended_item_id
+
+    recommender = get_recommender()
     # make recommendations, first parametr is id of item, second number of items to recommend
     recommended_item_id = recommender.make_recommendations(itemId, n_recommendations)
 
@@ -1,12 +1,33 @@
 import time
-from collections import Counter
 from sqlite3 import Connection
 
-from scripts.utils import create_connection
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+
+from scripts.category_tree import ITEM_CATEGORIES_QUERY, CategoryTree, get_category_tree
+from scripts.interning import get_item_interner
+from scripts.naive_algo import get_item_ratings
+from scripts.random_algo import MAX_SAMPLING_ROUNDS
+from scripts.relation_graph import get_relation_graph
+from scripts.utils import DBChangeCache, create_connection, fetch_in_chunks
+
+DIVERSITY_MODES = ["sum", "max", "squared"]
+SAMPLING_MODES = ["rating", "uniform"]
+# maximal number of items algorithm_related_with_category diversifies over
+CATEGORY_CANDIDATE_BUDGET = 1000
+# weight of items without rating in rating sampling
+MIN_SAMPLING_WEIGHT = 0.1
+# items of the categories of an item and of all their descendant categories
+SUBTREE_ITEMS_QUERY = ("SELECT items.itemId FROM item_category_list categories "
+                       "JOIN category_closure closure ON closure.ancestorId = categories.categoryId "
+                       "JOIN item_category_list items ON items.categoryId = closure.descendantId "
+                       "WHERE categories.itemId=(?)")
+# metadata of items, for fetch_in_chunks
+ITEMS_QUERY = "SELECT id, title, imageUrl, overallRating FROM item WHERE id IN ({})"
 
 
 class Item:
-    connection: Connection
+    __slots__ = ["id", "title", "image_url", "overall_rating", "related"]
     id: str
     title: str
     image_url: str
@@ -23,22 +44,61 @@ class Item:
         self.overall_rating = overall_rating
 
 
+class ItemSet:
+    # Items as aligned arrays, the item at index i has id ids[i], title titles[i] etc. Candidate sets are kept this way
+    # instead of thousands of Item objects, an Item is created only for a recommended one.
+    ids: list
+    # interned codes of the ids
+    codes: np.ndarray
+    titles: list
+    image_urls: list
+    # NaN for items without rating
+    overall_ratings: np.ndarray
+    # arrays of interned codes of related items of every item, None where they are not known
+    related: list
+
+    def __init__(self, ids: list, titles: list, image_urls: list, overall_ratings: list, related: list = None):
+        self.ids = ids
+        self.codes = get_item_interner().encode(ids)
+        self.titles = titles
+        self.image_urls = image_urls
+        self.overall_ratings = np.array(overall_ratings, dtype=np.float64)
+        self.related = [None] * len(ids) if related is None else related
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get_item(self, index: int) -> Item:
+        overall_rating = self.overall_ratings[index]
+        item = Item()
+        item.set_properties(self.ids[index], self.titles[index], self.image_urls[index],
+                            None if np.isnan(overall_rating) else float(overall_rating))
+        if self.related[index] is not None:
+            item.related = get_item_interner().decode(self.related[index])
+        return item
+
+
 class SimilarityRecommender:
     connection: Connection
     item_id: str
-    # {id -> Item}
-    similar_items: dict
-    # {id -> id -> float}
-    similarity_matrix: dict
-
-    def __init__(self, connection: Connection, item_id: str):
+    similar_items: ItemSet
+    # scipy sparse matrix, rows and columns are in order of similar_items
+    similarity_matrix: csr_matrix
+    # how similarities of a candidate to the selected items are combined, the less the more diverse it is:
+    # "sum" - sum of similarities, "max" - maximal similarity, "squared" - sum of squared similarities
+    diversity_mode: str
+
+    def __init__(self, connection: Connection, item_id: str, diversity_mode: str = "squared"):
+        if diversity_mode not in DIVERSITY_MODES:
+            raise Exception("Only following diversity modes are supported: [\"sum\", \"max\", \"squared\"]")
         self.connection = connection
         self.item_id = item_id
+        self.diversity_mode = diversity_mode
 
-    # find_similar_items_callback - Take one parameter item_id: str. Return dict in format {id -> Item}.
-    # count_similarities_callback - Take one parameter similar_items: dict - result of the function above. Return
-    # Two-dimensional dictionary, keys on both first and second level are the ids of items from similar_items.
-    # Value on index [x][y] and [y][x] is the same, it is float and corresponds to similarity of items x and y. Value
+    # find_similar_items_callback - Take one parameter item_id: str. Return ItemSet of the similar items.
+    # count_similarities_callback - Take one parameter similar_items: ItemSet - result of the function above. Return
+    # scipy sparse matrix, its rows and columns are the items from similar_items in their order. Value on index [x][y]
+    # and [y][x] is the same, it is float and corresponds to similarity of items x and y, missing values are 0. Value
     # [x][x] is not defined.
     #
     # Based on given callbacks find similar items and count similarities between them, and then find the given number
@@ -54,79 +114,61 @@ class SimilarityRecommender:
 
     # Do not call directly
     def get_diverse_recommenations(self, count) -> list:
-        if count > len(self.similarity_matrix):
-            count = len(self.similarity_matrix)
+        if count > len(self.similar_items):
+            count = len(self.similar_items)
+        similarities = csr_matrix(self.similarity_matrix)
+        similarities.sum_duplicates()
+
         # Find the best product as initial
-        best_item_id = None
-        best = -1
-        for item_id, item in self.similar_items.items():
-            if item.overall_rating > best:
-                best_item_id = item.id
-                best = item.overall_rating
-
-        if best_item_id:
-            selected_ids = {best_item_id}
-            self.similarity_matrix.pop(best_item_id)
-        else:
-            selected_ids = {}
-
-        for i in range(0, count - 1):
-            less_similar_item_id = None
-            less_similarity = float('inf')
-            for v in self.similarity_matrix:
-                # # V1
-                # similarity = 0
-                # for sel in selected_ids:
-                #     similarity += self.similarity_matrix[v][sel]
-                # if similarity < less_similarity:
-                #     less_similar_item_id = v
-                #     less_similarity = similarity
-                # # V2
-                # max_similarity = 0
-                # for sel in selected_ids:
-                #     sim = self.similarity_matrix[v][sel]
-                #     if sim > max_similarity:
-                #         max_similarity = sim
-                # if max_similarity < less_similarity:
-                #     less_similar_item_id = v
-                #     less_similarity = max_similarity
-                # V3
-                squared_similarity = 0
-                for sel in selected_ids:
-                    squared_similarity += (self.similarity_matrix[v][sel]) ** 2
-                if squared_similarity < less_similarity:
-                    less_similar_item_id = v
-                    less_similarity = squared_similarity
-
-            selected_ids.add(less_similar_item_id)
-            # print(less_similar_item_id)
-            self.similarity_matrix.pop(less_similar_item_id)
-
-        recommended_items = [self.similar_items[item_id] for item_id in selected_ids]
-
-        def sort_func(item: Item) -> float:
-            return item.overall_rating
-
-        recommended_items.sort(key=sort_func, reverse=True)
-
-        return recommended_items
-
-
-def find_similar_items_related(connection: Connection, main_item_id: str) -> dict:
-    cursor = connection.cursor()
-
-    similar_items = {main_item_id}  # the result
+        ratings = self.similar_items.overall_ratings
+        ratings = np.where(np.isnan(ratings), -np.inf, ratings)
+        best_index = int(np.argmax(ratings)) if len(ratings) > 0 else None
+
+        # Similarity of every candidate to the already selected items, updated with the non-zero values of one row
+        # after each pick. Selected items are excluded by infinity, the next pick is the less similar candidate.
+        accumulator = np.zeros(len(self.similar_items))
+        selected = []
+
+        def select(index: int):
+            selected.append(index)
+            row = slice(similarities.indptr[index], similarities.indptr[index + 1])
+            columns, values = similarities.indices[row], similarities.data[row]
+            if self.diversity_mode == "sum":
+                accumulator[columns] += values
+            elif self.diversity_mode == "max":
+                accumulator[columns] = np.maximum(accumulator[columns], values)
+            else:
+                accumulator[columns] += values ** 2
+            accumulator[index] = float('inf')
+
+        if best_index is not None and ratings[best_index] > -1 and count > 0:
+            select(best_index)
+        while len(selected) < count:
+            select(int(np.argmin(accumulator)))
+
+        # the best rated first
+        selected = np.array(selected, dtype=np.int64)
+        selected = selected[np.argsort(-ratings[selected], kind='stable')]
+
+        return [self.similar_items.get_item(index) for index in selected.tolist()]
+
+
+def find_similar_items_related(connection: Connection, main_item_id: str) -> ItemSet:
+    graph = get_relation_graph()
+    interner = get_item_interner()
+    main_item_code = interner.code(main_item_id)
+
+    similar_items = {main_item_code}  # the result
     items_relations_sets = {}  # optimization - remember the found relations for the items
-    last_added_items = {main_item_id}  # new discovered items in last iteration
+    last_added_items = {main_item_code}  # new discovered items in last iteration
     thresholds = [float('inf'), 101, 21, 11]  # how many items must be found to not start new iteration
     i = 0
     while i < len(thresholds) and len(similar_items) < thresholds[i]:
         new_items = set()
-        for item_id in last_added_items:
-            cur = cursor.execute("SELECT relatedItemId FROM item_related_list WHERE itemId = ?;", [item_id])
-            ids = [new_item[0] for new_item in cur]
-            items_relations_sets[item_id] = ids
-            new_items.update(ids)
+        for item_code in last_added_items:
+            related = graph.get_related(item_code)
+            items_relations_sets[item_code] = related
+            new_items.update(related.tolist())
 
         last_added_items = new_items.difference(similar_items)
         if len(last_added_items) == 0:  # optimization
@@ -134,151 +176,237 @@ def find_similar_items_related(connection: Connection, main_item_id: str) -> dic
         similar_items.update(last_added_items)
         i += 1
 
-    similar_items.remove(main_item_id)
+    similar_items.remove(main_item_code)
 
-    result_items = {}
-    for item_id in similar_items:
-        cur = cursor.execute("SELECT title, imageUrl, overallRating FROM item WHERE id = ?;", [item_id])
-        row = cur.fetchone()
-        item = Item()
-        item.set_properties(item_id, *row)
-        if item_id in items_relations_sets:
-            item.related = items_relations_sets[item_id]
-        result_items[item_id] = item
+    result_items = get_items(connection, interner.decode(list(similar_items)))
+    result_items.related = [items_relations_sets.get(item_code) for item_code in result_items.codes.tolist()]
 
-    cursor.close()
     return result_items
 
 
-def find_similar_items_category(connection: Connection, item_id: str) -> dict:
-    cursor = connection.execute("SELECT categoryId FROM item_category_list WHERE itemId=(?)", [item_id])
-    categories = set()
-    actual_categories = set()
-    for cat in cursor.fetchall():
-        categories.add(cat[0])
-        actual_categories.add(cat[0])
-    while actual_categories:
-        new_categories = set()
-        for category in actual_categories:
-            cursor = connection.execute("SELECT id FROM category WHERE parentCategoryId=(?)", [category])
-            new_categories.update([cat[0] for cat in cursor.fetchall()])
-        categories.update(new_categories)
-        actual_categories = new_categories
-
-    cursor = connection.execute("SELECT itemId FROM item_category_list WHERE categoryId IN ({});".format(",".join(['"{}"'.format(category) for category in categories])))
-    ids = [item[0] for item in cursor.fetchall()]
-    result_items = {}
-    for id in ids:
-        if id != item_id:
-            cursor = connection.execute("SELECT title, imageUrl, overallRating FROM item WHERE id=(?)", [id])
-            row = cursor.fetchone()
-            item = Item()
-            item.set_properties(id, *row)
-            result_items[id] = item
-
-    return result_items
-
-
-def find_similar_items_test(connection: Connection, item_id: str) -> dict:
-    item1 = Item()
-    item2 = Item()
-    item3 = Item()
-    item4 = Item()
-    item5 = Item()
-    item6 = Item()
-    item7 = Item()
-    item8 = Item()
-    item9 = Item()
-    item10 = Item()
-    item1.set_properties('1', 'Item 1', '', 4)
-    item2.set_properties('2', 'Item 2', '', 4.3)
-    item3.set_properties('3', 'Item 3', '', 3)
-    item4.set_properties('4', 'Item 4', '', 4.9)
-    item5.set_properties('5', 'Item 5', '', 3.1)
-    item6.set_properties('6', 'Item 6', '', 5)
-    item7.set_properties('7', 'Item 7', '', 4.5)
-    item8.set_properties('8', 'Item 8', '', 4)
-    item9.set_properties('9', 'Item 9', '', 2.6)
-    item10.set_properties('10', 'Item 10', '', 3.8)
-    items = {'1': item1, '2': item2, '3': item3, '4': item4, '5': item5, '6': item6, '7': item7, '8': item8, '9': item9,
-             '10': item10}
-    return items
-
-
-def count_similarities_related(connection: Connection, similar_items: dict) -> dict:
-    cursor = connection.cursor()
-
-    # Fill aux_matrix with values corresponding to number of relations between the items (the matrix is symmetric).
-    # They are included all related items to the similar items.
-    aux_matrix = initialize_matrix(similar_items.keys(), similar_items.keys())
-    outer_items = set()
-    for item in similar_items.values():
-        if item.related:
-            counts = Counter(item.related)
-            for item_id in counts:
-                if item_id in aux_matrix:
-                    aux_matrix[item_id][item.id] += counts[item_id]
-                    aux_matrix[item.id][item_id] += counts[item_id]
-        # else:
-    #     cur = cursor.execute("SELECT relatedItemId FROM item_related_list WHERE itemId = ?;", [item.id])
-    #     item.related = [row[0] for row in cur]
-    #     outer_items.update(item.related)
-    #     counts = Counter(item.related)
-    #     for item_id in counts:
-    #         if item_id not in aux_matrix:
-    #             aux_matrix[item_id] = {}
-    #         if item.id not in aux_matrix[item_id]:
-    #             aux_matrix[item_id][item.id] = 0
-    #         if item_id not in aux_matrix[item.id]:
-    #             aux_matrix[item.id][item_id] = 0
-    #         aux_matrix[item_id][item.id] += counts[item_id]
-    #         aux_matrix[item.id][item_id] += counts[item_id]
-    #
-    # outer_items.difference_update(similar_items.keys())
-    # for outer_item_id in outer_items:
-    #     cur = cursor.execute("SELECT relatedItemId FROM item_related_list WHERE itemId = ? AND relatedItemId IN ({});"
-    #                          .format(",".join(['"{}"'.format(item) for item in similar_items.keys()])),
-    #                          [outer_item_id])
-    #     related = [row[0] for row in cur]
-    #     counts = Counter(related)
-    #     for item_id in counts:
-    #         if item_id not in aux_matrix[outer_item_id]:
-    #             aux_matrix[outer_item_id][item_id] = 0
-    #         if outer_item_id not in aux_matrix[item_id]:
-    #             aux_matrix[item_id][outer_item_id] = 0
-    #         aux_matrix[item_id][outer_item_id] += counts[item_id]
-    #         aux_matrix[outer_item_id][item_id] += counts[item_id]
-
-    # # Count matrix as the result of aux_matrix to the power of 2, values are similarities between items that are
-    # # in relation in distance 2. Value is divided by 10 for comparing to the original values.
-    # matrix = initialize_matrix(similar_items.keys(), similar_items.keys())
-    # for i in similar_items.keys():
-    #     for j1 in aux_matrix[i]:
-    #         for j2 in aux_matrix:
-    #             if j2 in aux_matrix[j1]:
-    #                 print(i + ' ' + j1 + ' ' + j2)
-    #                 matrix[i][j2] += aux_matrix[i][j1] * aux_matrix[j1][j2] / 10
-    #
-    # # Sum the values - similarities of items in distance 1 and 2.
-    # for i in matrix:
-    #     for j in matrix:
-    #         matrix[i][j] += aux_matrix[i][j]
-
-    cursor.close()
-    # return matrix
-    return aux_matrix
-
-
-def initialize_matrix(rows: iter, cols: iter) -> dict:
-    matrix = {}
-    for i in rows:
-        matrix[i] = {}
-        for j in cols:
-            matrix[i][j] = 0
-    return matrix
+# budget - maximal number of returned items, None for all of them. Items of the deepest categories are taken first,
+# then of their ancestors up to the item's categories, until the budget is met. Items of the level which does not fit
+# into the budget whole are sampled - proportionally to their rating with sampling "rating", uniformly with "uniform".
+def find_similar_items_category(connection: Connection, item_id: str, budget: int = None,
+                                sampling: str = "rating") -> ItemSet:
+    if sampling not in SAMPLING_MODES:
+        raise Exception("Only following sampling modes are supported: [\"rating\", \"uniform\"]")
+    if budget is not None:
+        return get_items(connection, find_category_items_by_levels(connection, item_id, budget, sampling))
 
+    cursor = connection.execute(SUBTREE_ITEMS_QUERY, [item_id])
+    ids = [item[0] for item in cursor.fetchall()]
+    ids = [id for id in dict.fromkeys(ids) if id != item_id]
+
+    return get_items(connection, ids)
+
+
+# Items of categories are taken from the category tree in memory. A level which fits into the rest of the budget is
+# taken whole, a larger one is sampled at a cost growing with the budget, not with sizes of its categories.
+def find_category_items_by_levels(connection: Connection, item_id: str, budget: int, sampling: str) -> list:
+    category_tree, cumulative_weights = get_category_weights()
+    cursor = connection.execute(ITEM_CATEGORIES_QUERY, [item_id])
+    category_ids = set()
+    for category in cursor.fetchall():
+        category_ids.update(category_tree.get_descendants(category[0]))
+
+    # {depth -> [category id]}
+    levels = {}
+    for category_id in category_ids:
+        levels.setdefault(category_tree.depth.get(category_id, 0), []).append(category_id)
+
+    interner = get_item_interner()
+    codes = []
+    seen = {interner.code(item_id)}
+    for depth in sorted(levels, reverse=True):
+        count = budget - len(codes)
+        # an item can be in more categories of the level, so the sum of sizes is only an upper bound of its items
+        if sum(category_tree.get_item_count(category_id) for category_id in levels[depth]) <= count:
+            level_codes = np.concatenate([category_tree.get_item_codes(category_id) for category_id in levels[depth]])
+            level_codes = [code for code in dict.fromkeys(level_codes.tolist()) if code not in seen]
+        else:
+            level_codes = sample_category_items(category_tree, cumulative_weights, levels[depth], seen, count,
+                                                sampling)
+        codes.extend(level_codes)
+        seen.update(level_codes)
+        if len(codes) >= budget:
+            break
 
-def count_similarities_test(connection: Connection, similar_items: dict) -> dict:
+    return interner.decode(codes)
+
+
+# Return the category tree together with cumulative sums of weights of items at positions of its item_codes, with
+# a leading 0. Weight of an item is its rating, MIN_SAMPLING_WEIGHT for items without rating.
+def load_category_weights() -> tuple:
+    category_tree = get_category_tree()
+    ratings = get_item_ratings()
+    codes = category_tree.item_codes
+    weights = np.full(len(codes), MIN_SAMPLING_WEIGHT)
+    known = codes < len(ratings)
+    weights[known] = np.fmax(ratings[codes[known]], MIN_SAMPLING_WEIGHT)
+
+    cumulative_weights = np.zeros(len(codes) + 1)
+    np.cumsum(weights, out=cumulative_weights[1:])
+    return category_tree, cumulative_weights
+
+
+# the weights are loaded together with the tree, so that they stay aligned with its item_codes
+_category_weights = DBChangeCache(load_category_weights)
+
+
+def get_category_weights() -> tuple:
+    return _category_weights.get()
+
+
+# Return codes of at most count items of the categories which are not in seen. Every category gets its share of count
+# by its size, rounded down and the rest is given to categories drawn by their fractional parts.
+def sample_category_items(category_tree: CategoryTree, cumulative_weights: np.ndarray, category_ids: list,
+                          seen: set, count: int, sampling: str) -> list:
+    sizes = np.array([category_tree.get_item_count(category_id) for category_id in category_ids], dtype=np.float64)
+    if count <= 0 or sizes.sum() == 0:
+        return []
+
+    shares = count * sizes / sizes.sum()
+    quotas = np.floor(shares).astype(np.int64)
+    rest = count - quotas.sum()
+    if rest > 0:
+        fractions = shares - quotas
+        quotas[np.random.choice(len(quotas), rest, replace=False, p=fractions / fractions.sum())] += 1
+
+    codes = []
+    for category_id, quota in zip(category_ids, quotas.tolist()):
+        if quota == 0:
+            continue
+        chosen = draw_category_items(category_tree, cumulative_weights, category_id, seen, quota, sampling)
+        codes.extend(chosen)
+        seen = seen.union(chosen)
+
+    return codes
+
+
+# Return codes of at most count distinct items of the category which are not in seen. Items are drawn proportionally
+# to their weights by binary search in cumulative_weights with sampling "rating", uniformly with "uniform", repeated
+# draws are skipped. It costs O(count) draws, all items of the category are read only when MAX_SAMPLING_ROUNDS of
+# draws do not find enough of them.
+def draw_category_items(category_tree: CategoryTree, cumulative_weights: np.ndarray, category_id: int, seen: set,
+                        count: int, sampling: str) -> list:
+    start, end = category_tree.get_item_range(category_id)
+    chosen = {}
+    for _ in range(MAX_SAMPLING_ROUNDS):
+        missing = count - len(chosen)
+        if missing <= 0 or start == end:
+            break
+        if sampling == "rating":
+            draws = np.random.uniform(cumulative_weights[start], cumulative_weights[end], 2 * missing)
+            positions = np.minimum(np.searchsorted(cumulative_weights, draws, side='right') - 1, end - 1)
+        else:
+            positions = np.random.randint(start, end, 2 * missing)
+        for code in category_tree.item_codes[positions].tolist():
+            if code not in seen:
+                chosen.setdefault(code)
+
+    if len(chosen) < count:
+        # most items of the category are in seen, the rest of them are drawn at once without replacement
+        excluded = list(seen.union(chosen))
+        positions = start + np.flatnonzero(~np.isin(category_tree.item_codes[start:end], excluded))
+        if len(positions) > 0:
+            weights = cumulative_weights[positions + 1] - cumulative_weights[positions] if sampling == "rating" \
+                else np.ones(len(positions))
+            positions = np.random.choice(positions, min(count - len(chosen), len(positions)), replace=False,
+                                         p=weights / weights.sum())
+            chosen.update(dict.fromkeys(category_tree.item_codes[positions].tolist()))
+
+    return list(chosen)[:count]
+
+
+# Return ItemSet of given ids in their order, metadata of all of them are fetched at once.
+def get_items(connection: Connection, ids: iter) -> ItemSet:
+    ids = list(ids)
+    rows = {row[0]: row[1:] for row in fetch_in_chunks(connection, ITEMS_QUERY, ids)}
+    ids = [id for id in ids if id in rows]
+
+    return ItemSet(ids, [rows[id][0] for id in ids], [rows[id][1] for id in ids], [rows[id][2] for id in ids])
+
+
+def find_similar_items_test(connection: Connection, item_id: str) -> ItemSet:
+    ids = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10']
+    titles = ['Item 1', 'Item 2', 'Item 3', 'Item 4', 'Item 5', 'Item 6', 'Item 7', 'Item 8', 'Item 9', 'Item 10']
+    overall_ratings = [4, 4.3, 3, 4.9, 3.1, 5, 4.5, 4, 2.6, 3.8]
+    return ItemSet(ids, titles, [''] * len(ids), overall_ratings)
+
+
+# Return similarities of the items by numbers of relations between them. With distance 2, similarities of items in
+# relation in distance 2 are added (divided by 10 for comparing to the original values), it counts with relations of
+# all the items (not only of those with known related lists) and with outer items - related items which are not among
+# the given ones.
+def count_similarities_related(connection: Connection, similar_items: ItemSet, distance: int = 1) -> csr_matrix:
+    if distance not in [1, 2]:
+        raise Exception("Only following distances of related items are supported: [1, 2]")
+    item_codes = similar_items.codes
+
+    if distance == 1:
+        # Fill aux_matrix with values corresponding to number of relations between the items (the matrix is
+        # symmetric). They are included all related items to the similar items.
+        sources = []
+        related = []
+        for index, item_related in enumerate(similar_items.related):
+            if item_related is not None and len(item_related) > 0:
+                sources.append(np.full(len(item_related), index))
+                related.append(item_related)
+        sources = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+        related = np.concatenate(related) if related else np.empty(0, dtype=np.int32)
+    else:
+        # Relations of the similar items and of the outer items (only those back to the similar items), the outer
+        # items have rows and columns after the similar items.
+        graph = get_relation_graph()
+        outer_codes = np.setdiff1d(graph.expand(item_codes), item_codes)
+        all_codes = np.concatenate([item_codes, outer_codes])
+        sources = np.repeat(np.arange(len(all_codes)), graph.degree(all_codes))
+        related = graph.expand(all_codes)
+        item_codes = all_codes
+
+    # Entries are found by interned codes of the items, the matrix has only as many values as there are relations.
+    targets = get_indices(item_codes, related)
+    found = (targets >= 0) & ((sources < len(similar_items)) | (targets < len(similar_items)))
+    sources, targets = sources[found], targets[found]
+    aux_matrix = coo_matrix((np.ones(2 * len(sources)), (np.concatenate([sources, targets]),
+                                                         np.concatenate([targets, sources]))),
+                            shape=(len(item_codes), len(item_codes))).tocsr()
+
+    if distance == 1:
+        return aux_matrix
+
+    # Sum the values - similarities of items in distance 1 and 2, only the block of the similar items of
+    # aux_matrix to the power of 2 is counted.
+    count = len(similar_items)
+    return (aux_matrix[:count, :count] + aux_matrix[:count] @ aux_matrix[:, :count] / 10).tocsr()
+
+
+# Return indices of codes in item_codes, -1 for codes which are not there.
+def get_indices(item_codes: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    if len(item_codes) == 0:
+        return np.full(len(codes), -1, dtype=np.int64)
+    order = np.argsort(item_codes, kind='stable')
+    sorted_codes = item_codes[order]
+    positions = np.minimum(np.searchsorted(sorted_codes, codes), len(sorted_codes) - 1)
+    return np.where((codes >= 0) & (sorted_codes[positions] == codes), order[positions], -1)
+
+
+# Return scipy sparse matrix of similarities given as {id -> id -> float}, rows and columns are in order of
+# similar_items.
+def to_similarity_matrix(similar_items: ItemSet, similarities: dict) -> csr_matrix:
+    indices = {item_id: index for index, item_id in enumerate(similar_items.ids)}
+    rows, columns, values = [], [], []
+    for item_id, item_similarities in similarities.items():
+        for other_id, similarity in item_similarities.items():
+            if item_id in indices and other_id in indices and similarity:
+                rows.append(indices[item_id])
+                columns.append(indices[other_id])
+                values.append(similarity)
+    return coo_matrix((values, (rows, columns)), shape=(len(indices), len(indices))).tocsr()
+
+
+def count_similarities_test(connection: Connection, similar_items: ItemSet) -> csr_matrix:
     similarity_matrix = {
         '1': {
             '2': 3, '3': 4, '4': 0, '5': 0, '6': 0, '7': 0, '8': 0, '9': 0, '10': 0
@@ -311,14 +439,16 @@ def count_similarities_test(connection: Connection, similar_items: dict) -> dict
             '1': 0, '2': 0, '3': 0, '4': 3, '5': 3, '6': 4, '7': 1, '8': 9, '9': 7
         },
     }
-    return similarity_matrix
+    return to_similarity_matrix(similar_items, similarity_matrix)
 
 
-def algorithm_related(product_id: str, recommendations_count: int) -> list:
+# distance - 1 for similarities by direct relations of items, 2 for adding also relations in distance 2
+def algorithm_related(product_id: str, recommendations_count: int, distance: int = 1) -> list:
     connection = create_connection()
     similarity_recommender = SimilarityRecommender(connection, product_id)
-    recommended = similarity_recommender.recommend_products(recommendations_count, find_similar_items_related,
-                                                            count_similarities_related)
+    recommended = similarity_recommender.recommend_products(
+        recommendations_count, find_similar_items_related,
+        lambda connection, similar_items: count_similarities_related(connection, similar_items, distance))
     recommended_ids = []
     for product in recommended:
         recommended_ids.append(product.id)
@@ -327,11 +457,16 @@ def algorithm_related(product_id: str, recommendations_count: int) -> list:
     return recommended_ids
 
 
-def algorithm_related_with_category(product_id: str, recommendations_count: int) -> list:
+# distance - 1 for similarities by direct relations of items, 2 for adding also relations in distance 2
+# budget, sampling - maximal number of candidate items and how they are sampled, see find_similar_items_category
+def algorithm_related_with_category(product_id: str, recommendations_count: int, distance: int = 1,
+                                    budget: int = CATEGORY_CANDIDATE_BUDGET, sampling: str = "rating") -> list:
     connection = create_connection()
     similarity_recommender = SimilarityRecommender(connection, product_id)
-    recommended = similarity_recommender.recommend_products(recommendations_count, find_similar_items_category,
-                                                            count_similarities_related)
+    recommended = similarity_recommender.recommend_products(
+        recommendations_count,
+        lambda connection, item_id: find_similar_items_category(connection, item_id, budget, sampling),
+        lambda connection, similar_items: count_similarities_related(connection, similar_items, distance))
     recommended_ids = []
     for product in recommended:
         recommended_ids.append(product.id)
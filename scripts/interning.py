@@ -0,0 +1,165 @@
+import os
+import time
+from sqlite3 import Connection
+from threading import Lock
+
+import numpy as np
+
+from scripts.utils import DB_CHECK_INTERVAL, create_connection, lock_file
+
+INTERNING_PATH = "data/interning"
+
+
+class Interner:
+    """
+    This is a mapping of keys (ASINs, reviewer IDs or category IDs) to
+    dense int32 codes and back. It is append-only: a key keeps its code
+    forever and new keys get the next codes, so arrays indexed by codes
+    (and saved model artifacts holding codes) stay valid as data grow.
+    """
+
+    def __init__(self, keys=()):
+        self.keys = []
+        # key to its code
+        self.codes = {}
+        self.add(keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self.codes
+
+    def add(self, keys) -> np.ndarray:
+        """
+        return codes of keys, keys seen for the first time get new codes
+        """
+        codes = np.empty(len(keys), dtype=np.int32)
+        for i, key in enumerate(keys):
+            code = self.codes.get(key)
+            if code is None:
+                code = self.codes[key] = len(self.keys)
+                self.keys.append(key)
+            codes[i] = code
+        return codes
+
+    def encode(self, keys) -> np.ndarray:
+        """
+        return codes of keys, -1 for unknown keys
+        """
+        return np.fromiter((self.codes.get(key, -1) for key in keys), dtype=np.int32, count=len(keys))
+
+    def code(self, key) -> int:
+        return self.codes.get(key, -1)
+
+    def decode(self, codes) -> list:
+        return [self.keys[code] for code in codes]
+
+    def save(self, file_path: str):
+        # written aside and renamed, processes never load a half written file
+        tmp_path = file_path + '.tmp.npy'
+        np.save(tmp_path, np.array(self.keys))
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'Interner':
+        return cls(np.load(file_path).tolist())
+
+
+# name of interner to the query of its keys, new keys are added in sorted order
+INTERNER_QUERIES = {
+    "item": "SELECT id FROM item UNION SELECT itemId FROM review ORDER BY 1",
+    "user": "SELECT DISTINCT userId FROM review ORDER BY 1",
+    "category": "SELECT id FROM category ORDER BY 1"
+}
+
+# name of interner -> (modification of its file, time of the last check of the file, interner)
+_interners = {}
+_interners_lock = Lock()
+
+
+def get_interner_path(name: str) -> str:
+    return os.path.join(INTERNING_PATH, name + ".npy")
+
+
+def _lock_interning_files():
+    """
+    return an exclusive lock of INTERNING_PATH shared by all processes,
+    so that only one process at a time assigns new codes
+    """
+    os.makedirs(INTERNING_PATH, exist_ok=True)
+    return lock_file(os.path.join(INTERNING_PATH, "interning.lock"))
+
+
+def refresh_interners(connection: Connection = None):
+    """
+    add keys new in DB to all interners and save them into INTERNING_PATH,
+    call it after data are added into DB
+    """
+    db_con = connection or create_connection()
+
+    with _interners_lock, _lock_interning_files():
+        for name, query in INTERNER_QUERIES.items():
+            # the file is read again under the lock, so keys saved meanwhile by another process keep their codes
+            interner = _load_interner(name, reload=True)
+            size = len(interner)
+            interner.add([row[0] for row in db_con.execute(query)])
+            # saved only with new keys, so other processes do not load it again needlessly
+            if len(interner) > size or _interners[name][0] is None:
+                interner.save(get_interner_path(name))
+                _interners[name] = (_get_modification(name), time.monotonic(), interner)
+
+    if connection is None:
+        db_con.close()
+
+
+def _get_modification(name: str) -> tuple:
+    # keys are only added, a saved file differs in size or in modification time
+    path = get_interner_path(name)
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load_interner(name: str, reload: bool = False) -> Interner:
+    now = time.monotonic()
+    if name in _interners and not reload and now - _interners[name][1] < DB_CHECK_INTERVAL:
+        return _interners[name][2]
+
+    # loaded again when another process saved new keys, the file is checked at most once per DB_CHECK_INTERVAL
+    modified = _get_modification(name)
+    if name not in _interners or _interners[name][0] != modified:
+        interner = Interner.load(get_interner_path(name)) if modified is not None else Interner()
+    else:
+        interner = _interners[name][2]
+    _interners[name] = (modified, now, interner)
+    return interner
+
+
+def get_interner(name: str, reload: bool = False) -> Interner:
+    """
+    return the interner shared by all calls in the process, it is loaded
+    from INTERNING_PATH and checked for keys saved by other processes at
+    most once per DB_CHECK_INTERVAL seconds, or at once with reload;
+    the first call builds it from DB if it is not saved yet
+    """
+    with _interners_lock:
+        if name in _interners or os.path.exists(get_interner_path(name)):
+            return _load_interner(name, reload)
+
+    refresh_interners()
+    with _interners_lock:
+        return _load_interner(name)
+
+
+def get_item_interner(reload: bool = False) -> Interner:
+    return get_interner("item", reload)
+
+
+def get_user_interner(reload: bool = False) -> Interner:
+    return get_interner("user", reload)
+
+
+def get_category_interner(reload: bool = False) -> Interner:
+    return get_interner("category", reload)
@@ -1,67 +1,89 @@
 import sys
 from random import shuffle
 
-from scripts.utils import create_connection
+import numpy as np
+
+from scripts.category_rankings import get_category_ranking
+from scripts.category_tree import ITEM_CATEGORIES_QUERY, get_category_tree
+from scripts.interning import get_item_interner
+from scripts.relation_graph import get_relation_graph
+from scripts.utils import DBChangeCache, create_connection
+
+ITEM_RATINGS_QUERY = "SELECT id, overallRating FROM item"
+
+
+# Return overallRating of every item indexed by its interned code, NaN for unknown or unrated items.
+def load_item_ratings() -> np.ndarray:
+    with create_connection() as connection:
+        rows = connection.execute(ITEM_RATINGS_QUERY).fetchall()
+
+    # items new in DB are interned by now
+    interner = get_item_interner(reload=True)
+    codes = interner.encode([row[0] for row in rows])
+    ratings = np.full(len(interner), np.nan)
+    ratings[codes[codes >= 0]] = np.array([row[1] for row in rows], dtype=np.float64)[codes >= 0]
+    return ratings
+
+
+# ratings of known items change too when data are appended into DB
+_item_ratings = DBChangeCache(load_item_ratings)
+
+
+def get_item_ratings() -> np.ndarray:
+    return _item_ratings.get()
 
 
 # if items are less than 10, no fallback specified, returns all it has
 def get_top_10_by_rating(items: list) -> list:
-    with create_connection() as connection:
-        cursor = connection.execute("SELECT id, overallRating FROM item WHERE id "
-                                    "IN ({})".format(",".join(['"{}"'.format(item_id) for item_id in items])))
-        rated_pairs = [(pair[0], pair[1]) for pair in cursor.fetchall()]
+    return get_top_10_by_rating_codes(get_item_interner().encode(items))
 
-        rated_pairs.sort(key=lambda pair: pair[1], reverse=True)
 
-        # adds a bit of randomness to the result
-        rated_pairs = rated_pairs[:20]
-        shuffle(rated_pairs)
+def get_top_10_by_rating_codes(codes: np.ndarray) -> list:
+    ratings = get_item_ratings()
+    codes = np.unique(codes)
+    codes = codes[(codes >= 0) & (codes < len(ratings))]
+    # unrated items are never recommended
+    codes = codes[~np.isnan(ratings[codes])]
 
-        return [pair[0] for pair in rated_pairs[:10]]
+    if len(codes) > 20:
+        codes = codes[np.argpartition(-ratings[codes], 19)[:20]]
 
+    return shuffle_top_10(get_item_interner().decode(codes))
 
-def recommend_products_by_related(product_id: str, modification_type: str) -> list:
-    with create_connection() as connection:
 
-        if modification_type == "all":
-            cursor = connection.execute("SELECT relatedItemId FROM item_related_list WHERE itemId=(?)", (product_id,))
+# adds a bit of randomness to the result, returns 10 of the top 20 items
+def shuffle_top_10(top_items: list) -> list:
+    shuffle(top_items)
+
+    return top_items[:10]
+
 
-        else:
-            cursor = connection.execute("SELECT relatedItemId FROM item_related_list WHERE itemId=(?) AND relation=(?)",
-                                        (product_id, modification_type))
+def recommend_products_by_related(product_id: str, modification_type: str) -> list:
+    interner = get_item_interner()
+    relations = None if modification_type == "all" else [modification_type]
 
-        related = [item[0] for item in cursor.fetchall()]
+    related = get_relation_graph().get_related(interner.code(product_id), relations)
 
-        return get_top_10_by_rating(related)
+    return get_top_10_by_rating_codes(related)
 
 
 def recommend_products_by_category(product_id: str, modification_type: str) -> list:
     with create_connection() as connection:
-        cursor = connection.execute("SELECT categoryId FROM item_category_list WHERE itemId=(?)", (product_id,))
+        cursor = connection.execute(ITEM_CATEGORIES_QUERY, (product_id,))
         product_category_id = cursor.fetchone()[0]
 
+        # the best rated items are materialized by build_category_rankings
+        ranked_items = []
         if modification_type == "same_category":
-            cursor = connection.execute("SELECT itemId FROM item_category_list "
-                                        "WHERE categoryId=(?)", (product_category_id,))
+            ranked_items = get_category_ranking(connection, "category", product_category_id)
 
         elif modification_type == "sibling_category":
-            cursor = connection.execute("SELECT parentCategoryId FROM category WHERE id=(?)", (product_category_id,))
-            parent_category_id = cursor.fetchone()[0]
-
-            cursor = connection.execute("SELECT id FROM category WHERE parentCategoryId=(?)", (parent_category_id,))
-            category_siblings = [item[0] for item in cursor.fetchall()]
-            if parent_category_id:
-                category_siblings.append(parent_category_id)
-
-            cursor = connection.execute("SELECT itemId FROM item_category_list WHERE categoryId "
-                                        "IN ({})".format(",".join([str(item) for item in category_siblings])))
-
-        result_items = [item[0] for item in cursor.fetchall()]
-
-        if product_id in result_items:
-            result_items.remove(product_id)
+            # root categories have no siblings
+            parent_category_id = get_category_tree().parent.get(product_category_id)
+            if parent_category_id is not None:
+                ranked_items = get_category_ranking(connection, "siblings", parent_category_id)
 
-        return get_top_10_by_rating(result_items)
+    return shuffle_top_10([item_id for item_id in ranked_items if item_id != product_id][:20])
 
 
 # left here for now, so it is possible easily try out the algos
@@ -0,0 +1,18 @@
+import argparse
+from datetime import datetime
+
+from scripts.collaborative_filtering import get_recommender, store_item_neighbors
+
+# run after setup_db.py and again whenever reviews change
+# e.g. python3 scripts/precompute_neighbors.py --neighbors 20
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--neighbors", type=int, default=10,
+                        help="This is a number of neighbors stored for every item.")
+    parser.add_argument("--block_size", type=int, default=256,
+                        help="This is a number of items whose similarities to all items are computed at once.")
+    args = parser.parse_args()
+
+    start_time = datetime.now()
+    store_item_neighbors(get_recommender(), args.neighbors, args.block_size)
+    print("DONE - Script execution took: {}".format(datetime.now() - start_time))
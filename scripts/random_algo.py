@@ -1,22 +1,94 @@
+import random
 import sys
 
-from scripts.utils import create_connection
+import numpy as np
 
+from scripts.utils import DBChangeCache, create_connection
 
-def recommend_products_randomly(product_id: str) -> list:
-    connection = create_connection()
+WEIGHTS = ["rating", "sales_rank"]
+# rounds of weighted draws before the items are drawn at once without replacement
+MAX_SAMPLING_ROUNDS = 4
+ITEM_WEIGHTS_QUERY = "SELECT id, overallRating, salesRank FROM item"
+
+
+class ItemSampler:
+    # ids of all items in the order of their rows in item table
+    ids: list
+    # {weights -> weights of items}, an item is sampled with probability proportional to its rating (weights "rating")
+    # or to 1 / its sales rank (weights "sales_rank"), items without them are not sampled
+    weights: dict
+    # {weights -> cumulative sums of the weights of items}
+    cumulative_weights: dict
+    # {weights -> number of items with positive weight}
+    weighted_counts: dict
+
+    def __init__(self):
+        self.refresh()
+
+    # Load items from item table again, call when ratings or sales ranks in the DB change.
+    def refresh(self):
+        connection = create_connection()
+
+        with connection:
+            rows = connection.execute(ITEM_WEIGHTS_QUERY).fetchall()
+
+        connection.close()
+
+        self.ids = [row[0] for row in rows]
+        ratings = np.nan_to_num(np.array([row[1] for row in rows], dtype=np.float64))
+        sales_ranks = np.array([row[2] for row in rows], dtype=np.float64)
+        sales_ranks = np.where(sales_ranks > 0, 1 / np.where(sales_ranks > 0, sales_ranks, 1), 0)
+
+        self.weights = {"rating": np.maximum(ratings, 0), "sales_rank": sales_ranks}
+        self.cumulative_weights = {}
+        self.weighted_counts = {}
+        for name, weights in self.weights.items():
+            self.cumulative_weights[name] = np.cumsum(weights)
+            self.weighted_counts[name] = int(np.count_nonzero(weights))
 
-    with connection:
-        cursor = connection.execute("SELECT id FROM item ORDER BY RANDOM() LIMIT 10;")
-        recommended_products = [item[0] for item in cursor.fetchall()]
+    # Return count distinct random items, without items in exclude. Items are sampled uniformly, or proportionally to
+    # given weights (one of WEIGHTS). It usually costs O(count + len(exclude)), not O(number of items), weighted
+    # sampling costs O(number of items) when MAX_SAMPLING_ROUNDS of draws do not find enough distinct items.
+    def sample(self, count: int, exclude: iter = (), weights: str = None) -> list:
+        if weights is not None and weights not in WEIGHTS:
+            raise Exception("Only following weights of random sampling are supported: [\"rating\", \"sales_rank\"]")
+        exclude = set(exclude)
 
-        # to ensure that the product_id is not in its own list of recommended products
-        while product_id in recommended_products:
-            recommended_products.remove(product_id)
-            cursor = connection.execute("SELECT id FROM item ORDER BY RANDOM() LIMIT 1;")
-            recommended_products.append(cursor.fetchone()[0])
+        if weights is None:
+            positions = random.sample(range(len(self.ids)), min(count + len(exclude), len(self.ids)))
+        else:
+            # items drawn by binary search in cumulative weights, repeated draws are skipped
+            cumulative_weights = self.cumulative_weights[weights]
+            wanted = min(count + len(exclude), self.weighted_counts[weights])
+            positions = {}
+            for _ in range(MAX_SAMPLING_ROUNDS):
+                if len(positions) >= wanted:
+                    break
+                draws = np.random.random_sample(wanted) * cumulative_weights[-1]
+                for position in np.searchsorted(cumulative_weights, draws, side='right').tolist():
+                    positions.setdefault(position)
 
-        return recommended_products
+            if len(positions) < wanted:
+                # a few items with most of the weight repeat, they are drawn at once without replacement instead
+                item_weights = self.weights[weights]
+                nonzero = np.flatnonzero(item_weights)
+                positions = np.random.choice(nonzero, wanted, replace=False,
+                                             p=item_weights[nonzero] / item_weights[nonzero].sum())
+            positions = list(positions)[:wanted]
+
+        return [self.ids[position] for position in positions if self.ids[position] not in exclude][:count]
+
+
+_item_sampler = DBChangeCache(ItemSampler)
+
+
+def get_item_sampler() -> ItemSampler:
+    return _item_sampler.get()
+
+
+def recommend_products_randomly(product_id: str) -> list:
+    # the product_id is not in its own list of recommended products
+    return get_item_sampler().sample(10, exclude={product_id})
 
 
 # left here for now, so it is possible easily try out the algo
@@ -24,5 +96,5 @@ def recommend_products_randomly(product_id: str) -> list:
 # e.g. python3 scripts/random_algo.py "B000EGELPU"
 if __name__ == "__main__":
     product_id = sys.argv[1]
-    recommended = recommend_products(product_id)
+    recommended = recommend_products_randomly(product_id)
     print(recommended)
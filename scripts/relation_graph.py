@@ -0,0 +1,107 @@
+import numpy as np
+
+from scripts.interning import get_item_interner
+from scripts.utils import DBChangeCache, create_connection
+
+# relation types, an edge stores the index of its relation as uint8
+RELATIONS = ["also_bought", "also_viewed", "bought_together", "buy_after_viewing"]
+ITEM_RELATIONS_QUERY = "SELECT itemId, relatedItemId, relation FROM item_related_list"
+
+
+class RelationGraph:
+    # Graph of item_related_list in CSR format over interned item codes. Edges of the item with code c are at positions
+    # indptr[c]:indptr[c + 1] of indices (codes of related items) and relations (their relation types), sorted by
+    # relation type and related item.
+    indptr: np.ndarray
+    indices: np.ndarray
+    relations: np.ndarray
+
+    def __init__(self):
+        self.refresh()
+
+    # Load the graph from item_related_list table again, call when the DB changes.
+    def refresh(self):
+        connection = create_connection()
+
+        with connection:
+            rows = connection.execute(ITEM_RELATIONS_QUERY).fetchall()
+
+        connection.close()
+
+        # items new in DB are interned by now
+        interner = get_item_interner(reload=True)
+        relation_types = {relation: relation_type for relation_type, relation in enumerate(RELATIONS)}
+        sources = interner.encode([row[0] for row in rows])
+        targets = interner.encode([row[1] for row in rows])
+        relations = np.fromiter((relation_types.get(row[2], len(RELATIONS)) for row in rows), dtype=np.uint8,
+                                count=len(rows))
+        # edges of unknown items or of unknown relation types are left out
+        known = (sources >= 0) & (targets >= 0) & (relations < len(RELATIONS))
+        sources, targets, relations = sources[known], targets[known], relations[known]
+
+        order = np.lexsort((targets, relations, sources))
+        self.indices = targets[order]
+        self.relations = relations[order]
+        self.indptr = np.zeros(len(interner) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(interner)), out=self.indptr[1:])
+
+    # Return positions of edges of the items in indices and relations, only of given relation types if any.
+    def get_edges(self, codes: np.ndarray, relations: list = None) -> np.ndarray:
+        codes = np.asarray(codes, dtype=np.int64)
+        # items new since the graph was loaded have no edges
+        codes = codes[(codes >= 0) & (codes < len(self.indptr) - 1)]
+        starts = self.indptr[codes]
+        lengths = self.indptr[codes + 1] - starts
+        edges = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        if relations is not None:
+            edges = edges[np.isin(self.relations[edges], [RELATIONS.index(relation) for relation in relations])]
+        return edges
+
+    # Return codes of items related to the item, an item related by several relations is there several times.
+    def get_related(self, code: int, relations: list = None) -> np.ndarray:
+        return self.indices[self.get_edges([code], relations)]
+
+    # Return codes of items related to any of the items, an item is there once for every its relation.
+    def expand(self, codes: np.ndarray, relations: list = None) -> np.ndarray:
+        return self.indices[self.get_edges(codes, relations)]
+
+    # Return unique codes of items in distance 1 to k from the items, without the items themselves.
+    def k_hop(self, codes: np.ndarray, k: int, relations: list = None) -> np.ndarray:
+        visited = np.unique(np.asarray(codes, dtype=np.int32))
+        frontier = visited
+        reached = []
+        for _ in range(k):
+            frontier = np.setdiff1d(self.expand(frontier, relations), visited)
+            if len(frontier) == 0:
+                break
+            reached.append(frontier)
+            visited = np.union1d(visited, frontier)
+        return np.concatenate(reached) if reached else np.empty(0, dtype=np.int32)
+
+    # Return numbers of relations of the items, only of given relation types if any.
+    def degree(self, codes: np.ndarray, relations: list = None) -> np.ndarray:
+        codes = np.asarray(codes, dtype=np.int64)
+        if relations is None:
+            positions = self.indptr
+        else:
+            # number of edges of given types before every position
+            positions = np.zeros(len(self.relations) + 1, dtype=np.int64)
+            np.cumsum(np.isin(self.relations, [RELATIONS.index(relation) for relation in relations]),
+                      out=positions[1:])
+            positions = positions[self.indptr]
+
+        known = (codes >= 0) & (codes < len(self.indptr) - 1)
+        degrees = np.zeros(len(codes), dtype=np.int64)
+        degrees[known] = positions[codes[known] + 1] - positions[codes[known]]
+        return degrees
+
+    def has_edge(self, code: int, related_code: int, relation: str) -> bool:
+        return related_code in self.get_related(code, [relation])
+
+
+_relation_graph = DBChangeCache(RelationGraph)
+
+
+def get_relation_graph() -> RelationGraph:
+    return _relation_graph.get()
@@ -4,6 +4,8 @@ from collections import Counter
 
 from scripts.utils import create_connection
 
+CATEGORY_SIZES_QUERY = "SELECT count(itemId) FROM item_category_list GROUP BY categoryId;"
+
 
 def parse(path):
     g = gzip.open(path, 'r')
@@ -14,7 +16,7 @@ def parse(path):
 # from the database
 def categories_statistics():
     connection = create_connection()
-    category_items_counts_cur = connection.execute("SELECT count(itemId) FROM item_category_list GROUP BY categoryId;")
+    category_items_counts_cur = connection.execute(CATEGORY_SIZES_QUERY)
     category_items_counts = [c[0] for c in category_items_counts_cur]
     category_items_counts_sorted = sorted(category_items_counts)
     category_items_counts_statistics = Counter(category_items_counts)
@@ -2,18 +2,41 @@ from collections import Counter
 import operator
 from sqlite3 import Connection
 
-from scripts.utils import create_connection
+import numpy as np
+
+from scripts.interning import Interner, get_item_interner
+from scripts.relation_graph import RELATIONS, RelationGraph, get_relation_graph
+from scripts.utils import create_connection, fetch_in_chunks
+
+ITEM_TITLES_QUERY = "SELECT id, title FROM item WHERE id IN ({})"
+ITEM_IDS_QUERY = "SELECT id FROM item;"
+SAMPLE_ITEMS_QUERY = "SELECT id FROM item DESC LIMIT ? OFFSET ?;"
+ITEM_TITLE_QUERY = "SELECT title FROM item WHERE id = ?;"
 
 class RelatedItemsExplorer:
 
     connection: Connection
+    graph: RelationGraph
+    interner: Interner
 
     def __init__(self):
         self.connection = create_connection()
+        self.graph = get_relation_graph()
+        self.interner = get_item_interner()
+
+    # Return [(relatedItemId, relation)] of the item from the relation graph.
+    def get_item_relations(self, item_id):
+        edges = self.graph.get_edges([self.interner.code(item_id)])
+        return list(zip(self.interner.decode(self.graph.indices[edges]),
+                        [RELATIONS[relation] for relation in self.graph.relations[edges]]))
+
+    # Return {id -> title} of the items, fetched at once.
+    def get_titles(self, item_ids):
+        return dict(fetch_in_chunks(self.connection, ITEM_TITLES_QUERY, item_ids))
 
     def related_statistics(self):
-        item_relations_counts_cur = self.connection.execute("SELECT count(item_related_list.relatedItemId) FROM item LEFT JOIN item_related_list ON item.id = item_related_list.itemId GROUP BY item_related_list.itemId;")
-        item_relations_counts = [c[0] for c in item_relations_counts_cur]
+        item_ids = [row[0] for row in self.connection.execute(ITEM_IDS_QUERY)]
+        item_relations_counts = self.graph.degree(self.interner.encode(item_ids)).tolist()
         item_relations_counts_statistics = Counter(item_relations_counts)
         item_relations_counts_sorted = sorted(item_relations_counts)
         item_relations_counts_statistics_sorted = sorted(item_relations_counts_statistics.items())
@@ -28,8 +51,8 @@ class RelatedItemsExplorer:
             for c in item_relations_counts_statistics_sorted:
                 outp.write(str(c[0]) + '\t' + str(c[1]) + '\n')
 
-        relations_counts_cur = self.connection.execute("SELECT relation, count(itemId) FROM item_related_list GROUP BY relation;")
-        relations_counts = [c_rel for c_rel in relations_counts_cur]
+        relation_types_counts = np.bincount(self.graph.relations, minlength=len(RELATIONS))
+        relations_counts = [(rel, int(count)) for rel, count in zip(RELATIONS, relation_types_counts) if count > 0]
         relations_counts_sorted = sorted(relations_counts, key=operator.itemgetter(1))
 
         with open('../data/statistics/relations_counts.txt', 'w', encoding='utf-8') as outp:
@@ -39,10 +62,7 @@ class RelatedItemsExplorer:
 
     def check_symmetry(self, limit=20, offset=0):
 
-        cursor = self.connection.cursor()
-
-        sample_items_cur = self.connection.execute("SELECT id FROM item DESC LIMIT ? OFFSET ?;",
-                                                   [limit, offset])
+        sample_items_cur = self.connection.execute(SAMPLE_ITEMS_QUERY, [limit, offset])
         sample_items = sample_items_cur.fetchall()
 
         also_bought_symmetric = 0
@@ -58,48 +78,33 @@ class RelatedItemsExplorer:
 
         for sample_item in sample_items:
             item_id = sample_item[0]
-            relations = self.connection.execute("SELECT relatedItemId, relation FROM item_related_list WHERE itemId = ?;",
-                                                [item_id])
+            item_code = self.interner.code(item_id)
+            relations = self.get_item_relations(item_id)
 
             for (related_item_id, relation) in relations:
                 rel_count += 1
+                inverse = self.graph.has_edge(self.interner.code(related_item_id), item_code, relation)
 
                 if relation == 'also_bought':
-                    cursor.execute(
-                        "SELECT itemId FROM item_related_list WHERE itemId = ? AND relatedItemId = ? AND relation = 'also_bought';",
-                        [related_item_id, item_id])
-                    inverse = cursor.fetchone()
-                    if inverse is None:
+                    if not inverse:
                         also_bought_antisymmetric += 1
                     else:
                         also_bought_symmetric += 1
 
                 elif relation == 'also_viewed':
-                    cursor.execute(
-                        "SELECT itemId FROM item_related_list WHERE itemId = ? AND relatedItemId = ? AND relation = 'also_viewed';",
-                        [related_item_id, item_id])
-                    inverse = cursor.fetchone()
-                    if inverse is None:
+                    if not inverse:
                         also_viewed_antisymmetric += 1
                     else:
                         also_viewed_symmetric += 1
 
                 elif relation == 'bought_together':
-                    cursor.execute(
-                        "SELECT itemId FROM item_related_list WHERE itemId = ? AND relatedItemId = ? AND relation = 'bought_together';",
-                        [related_item_id, item_id])
-                    inverse = cursor.fetchone()
-                    if inverse is None:
+                    if not inverse:
                         bought_together_antisymmetric += 1
                     else:
                         bought_together_symmetric += 1
 
                 elif relation == 'buy_after_viewing':
-                    cursor.execute(
-                        "SELECT itemId FROM item_related_list WHERE itemId = ? AND relatedItemId = ? AND relation = 'buy_after_viewing';",
-                        [related_item_id, item_id])
-                    inverse = cursor.fetchone()
-                    if inverse is None:
+                    if not inverse:
                         buy_after_viewing_antisymmetric += 1
                     else:
                         buy_after_viewing_symmetric += 1
@@ -122,7 +127,7 @@ class RelatedItemsExplorer:
 
     def get_relations(self, item_id):
 
-        aa = self.connection.execute("SELECT title FROM item WHERE id = ?;", [item_id])
+        aa = self.connection.execute(ITEM_TITLE_QUERY, [item_id])
         item_name_tuple = aa.fetchone()
         if item_name_tuple[0] is not None:
             item_name = item_name_tuple[0]
@@ -131,13 +136,12 @@ class RelatedItemsExplorer:
         print('Item name: ' + item_name)
         print()
 
-        relations = self.connection.execute("SELECT relatedItemId, relation FROM item_related_list WHERE itemId = ?;",
-                                            [item_id])
+        relations = self.get_item_relations(item_id)
+        titles = self.get_titles([related_item_id for related_item_id, _ in relations])
         related_items = []
 
         for related_item_id, relation in relations:
-            name = self.connection.execute('SELECT title FROM item WHERE id = ?', [related_item_id])
-            related_items.append((relation, related_item_id, name.fetchone()))
+            related_items.append((relation, related_item_id, (titles.get(related_item_id),)))
 
         self.connection.close()
 
@@ -160,10 +164,10 @@ class RelatedItemsExplorer:
     def get_relations_for_graph(self, item_id, color):
         not_only_also_view = False
 
-        relations = self.connection.execute("SELECT relatedItemId, relation FROM item_related_list WHERE itemId = ?;",
-                                            [item_id])
+        relations = self.get_item_relations(item_id)
+        titles = self.get_titles([related_item_id for related_item_id, _ in relations])
 
-        aa = self.connection.execute("SELECT title FROM item WHERE id = ?;", [item_id])
+        aa = self.connection.execute(ITEM_TITLE_QUERY, [item_id])
         item_name_tuple = aa.fetchone()
         if (item_name_tuple is not None) and (item_name_tuple[0] is not None):
             item_name = item_name_tuple[0]
@@ -190,10 +194,8 @@ class RelatedItemsExplorer:
         graph = []
 
         for (related_item_id, relation) in relations:
-            name_cur = self.connection.execute("SELECT title FROM item WHERE id = ?", [related_item_id])
-            name_tuple = name_cur.fetchone()
-            if name_tuple[0] is not None:
-                name = name_tuple[0]
+            if titles.get(related_item_id) is not None:
+                name = titles[related_item_id]
             else:
                 name = 'No title'
             rel_item = '"' + related_item_id + ' ' + name[:50] + '"'
@@ -214,7 +216,7 @@ class RelatedItemsExplorer:
         return graph_string
 
     def get_name(self, item_id):
-        aa = self.connection.execute("SELECT title FROM item WHERE id = ?;", [item_id])
+        aa = self.connection.execute(ITEM_TITLE_QUERY, [item_id])
         print(aa.fetchone())
 
         self.connection.close()
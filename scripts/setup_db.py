@@ -1,20 +1,80 @@
 import argparse
+import ast
 import gzip
+import json
+import os
 import sqlite3
 import time
 from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool
 from sys import stdout
 
-from scripts.utils import create_connection
+from scripts.category_rankings import build_category_rankings
+from scripts.category_tree import build_category_closure
+from scripts.interning import refresh_interners
+from scripts.utils import create_connection, fetch_in_chunks
 
 LAST_TIME_CHECKPOINT = None
+PARSE_CHUNK_SIZE = 1000
+BATCH_SIZE = 1000
+
+USER_INSERT_QUERY = "INSERT OR IGNORE INTO user(id, name) VALUES (?, ?)"
+ITEM_INSERT_QUERY = ("INSERT OR IGNORE INTO "
+                     "item(id, title, description, price, imageUrl, salesCategory, salesRank, overallRating) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+CATEGORY_INSERT_QUERY = "INSERT INTO category(parentCategoryId, namespace, name) VALUES (?, ?, ?)"
+CATEGORY_IDS_QUERY = "SELECT namespace, id FROM category"
+# relations to items without metadata are dropped after all metadata is loaded
+RELATED_CLEANUP_QUERY = "DELETE FROM item_related_list WHERE relatedItemId NOT IN (SELECT id FROM item)"
+LAST_REVIEW_ID_QUERY = "SELECT max(id) FROM review"
+NEW_RATINGS_QUERY = "SELECT itemId, rating FROM review WHERE id > ?"
+ANY_REVIEW_QUERY = "SELECT 1 FROM review LIMIT 1"
+ANY_RATING_AGGREGATE_QUERY = "SELECT 1 FROM item_rating_aggregate LIMIT 1"
+CHECKPOINT_QUERY = "SELECT offset, finished FROM ingest_checkpoint WHERE filePath = ? AND fileSize = ?"
+CHECKPOINT_UPSERT_QUERY = ("INSERT OR REPLACE INTO ingest_checkpoint(filePath, fileSize, offset, finished) "
+                           "VALUES (?, ?, ?, ?)")
+RATING_AGGREGATE_UPSERT_QUERY = ("INSERT INTO item_rating_aggregate(itemId, ratingSum, ratingCount) VALUES (?, ?, ?) "
+                                 "ON CONFLICT(itemId) DO UPDATE SET ratingSum = ratingSum + excluded.ratingSum, "
+                                 "ratingCount = ratingCount + excluded.ratingCount")
+RATING_AGGREGATES_QUERY = "SELECT itemId, ratingSum, ratingCount FROM item_rating_aggregate"
+# aggregates of the given items, for fetch_in_chunks
+ITEM_RATING_AGGREGATES_QUERY = RATING_AGGREGATES_QUERY + " WHERE itemId IN ({})"
+OVERALL_RATING_UPDATE_QUERY = "UPDATE item SET overallRating = ? WHERE id = ?"
+
+# rows of the lists are inserted as they are into a new DB; in append mode rows already in DB are skipped, they are
+# looked up by the indexes of indexes.sql
+REVIEW_INSERT_QUERY = "INSERT INTO review(userId, itemId, rating, reviewTime) VALUES (?, ?, ?, ?)"
+REVIEW_APPEND_QUERY = ("INSERT INTO review(userId, itemId, rating, reviewTime) SELECT ?1, ?2, ?3, ?4 WHERE NOT EXISTS "
+                       "(SELECT 1 FROM review WHERE userId = ?1 AND itemId = ?2 AND reviewTime IS ?4)")
+ITEM_CATEGORY_INSERT_QUERY = "INSERT INTO item_category_list(itemId, categoryId) VALUES (?, ?)"
+ITEM_CATEGORY_APPEND_QUERY = ("INSERT INTO item_category_list(itemId, categoryId) SELECT ?1, ?2 WHERE NOT EXISTS "
+                              "(SELECT 1 FROM item_category_list WHERE itemId = ?1 AND categoryId = ?2)")
+ITEM_RELATED_INSERT_QUERY = "INSERT INTO item_related_list(itemId, relatedItemId, relation) VALUES (?, ?, ?)"
+ITEM_RELATED_APPEND_QUERY = ("INSERT INTO item_related_list(itemId, relatedItemId, relation) SELECT ?1, ?2, ?3 "
+                             "WHERE NOT EXISTS (SELECT 1 FROM item_related_list "
+                             "WHERE itemId = ?1 AND relation IS ?3 AND relatedItemId = ?2)")
+# rating aggregates of a DB built before they were stored, from all its reviews
+RATING_AGGREGATE_FILL_QUERY = ("INSERT INTO item_rating_aggregate(itemId, ratingSum, ratingCount) "
+                               "SELECT itemId, sum(rating), count(*) FROM review GROUP BY itemId")
+
+
+def decode_line(line: bytes):
+    # review files are strict JSON, metadata files are Python literals (single quotes), so fall back to literal_eval
+    try:
+        return json.loads(line)
+    except ValueError:
+        return ast.literal_eval(line.decode('utf-8'))
 
 
 class DBSetup:
     SCHEMA = 'schema.sql'
+    INDEXES = 'indexes.sql'
 
     def __init__(self):
         self.args = self.parse_commandline()
+        # {stage -> [rows inserted, seconds spent by inserting them]}, inserts of a stage are spread over batches
+        self.insert_times = {}
 
     @staticmethod
     def parse_commandline():
@@ -24,6 +84,11 @@ class DBSetup:
                             help="This is a path to an input file (.json.gz) with reviews.")
         parser.add_argument("--meta_file", type=str, required=True,
                             help="This is a path to an input file (.json.gz) with metadata.")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="This is a number of processes used for decoding lines of the input files.")
+        parser.add_argument("--append", action="store_true",
+                            help="Add new reviews and metadata into an already populated DB. Rows already in DB are "
+                                 "skipped and an interrupted run continues from the last checkpoint.")
 
         return parser.parse_args()
 
@@ -43,38 +108,136 @@ class DBSetup:
         stdout.flush()
         time.sleep(2)
 
-    def escape(self, input: str):
-        if input:
-            replaced = input.replace('"', '')
-            return replaced
-        return input
+    def rows_per_second(self, count: int, started: datetime):
+        seconds = (datetime.now() - started).total_seconds()
+        return round(count / seconds) if seconds > 0 else count
+
+    def count_inserted(self, stage: str, count: int, started: datetime):
+        rows_and_seconds = self.insert_times.setdefault(stage, [0, 0.0])
+        rows_and_seconds[0] += count
+        rows_and_seconds[1] += (datetime.now() - started).total_seconds()
+
+    def inserted_per_second(self, stage: str) -> int:
+        count, seconds = self.insert_times.get(stage, [0, 0.0])
+        return round(count / seconds) if seconds > 0 else count
 
     def prepare_tables(self, db_con):
         with open(self.SCHEMA) as schema:
             for sql_command in schema.read().split(';'):
                 db_con.execute(sql_command)
 
-    def get_chunks(self, lst: list, n: int):
-        # yield successive n-sized chunks from lst
-        for i in range(0, len(lst), n):
-            yield lst[i:i + n]
+    def create_indexes(self, db_con: sqlite3.Connection):
+        with open(self.INDEXES) as indexes:
+            for sql_command in indexes.read().split(';'):
+                db_con.execute(sql_command)
 
-    def parse(self, file_path):
-        g = gzip.open(file_path, 'r')
+    def build_indexes(self, db_con: sqlite3.Connection):
+        self.create_indexes(db_con)
+        db_con.execute("ANALYZE")
+        db_con.commit()
+
+    def prepare_append(self, db_con: sqlite3.Connection):
+        # a DB built before append mode existed has neither the indexes, which existing rows are looked up by, nor
+        # rating aggregates, which ratings of its items are updated from
+        self.create_indexes(db_con)
+        if not db_con.execute(ANY_RATING_AGGREGATE_QUERY).fetchone() and db_con.execute(ANY_REVIEW_QUERY).fetchone():
+            self.log("Filling rating aggregates from reviews in DB...")
+            db_con.execute(RATING_AGGREGATE_FILL_QUERY)
+        db_con.commit()
+
+    def parse(self, file_path, offset: int = 0):
+        # yield decoded lines together with an offset (in the uncompressed file) right after the line
+        with gzip.open(file_path, 'r') as g:
+            g.seek(offset)
+
+            if self.args.workers > 1:
+                # decode lines in worker processes window by window, so that not more than a window of decoded
+                # lines waits in memory for being inserted (imap would read ahead the whole file)
+                window_size = 2 * self.args.workers * PARSE_CHUNK_SIZE
+                with Pool(self.args.workers) as pool:
+                    lines = list(islice(g, window_size))
+                    while lines:
+                        for line, decoded in zip(lines, pool.map(decode_line, lines, chunksize=PARSE_CHUNK_SIZE)):
+                            offset += len(line)
+                            yield offset, decoded
+                        lines = list(islice(g, window_size))
+            else:
+                for line in g:
+                    offset += len(line)
+                    yield offset, decode_line(line)
+
+    def get_checkpoint(self, db_con: sqlite3.Connection, file_path: str) -> tuple:
+        cursor = db_con.execute(CHECKPOINT_QUERY, [file_path, os.path.getsize(file_path)])
+        checkpoint = cursor.fetchone()
+        return checkpoint if checkpoint else (0, False)
+
+    def commit_batch(self, db_con: sqlite3.Connection, file_path: str, offset: int, finished: bool = False):
+        # in append mode every batch is committed together with the checkpoint, so an interrupted load can resume
+        # from the last committed batch; otherwise the whole part is committed at once
+        if self.args.append or finished:
+            db_con.execute(CHECKPOINT_UPSERT_QUERY, [file_path, os.path.getsize(file_path), offset, finished])
+            db_con.commit()
 
-        for l in g:
-            yield eval(l)
+    def get_overall_rating(self, rating_sum: float, rating_count: int) -> float:
+        return round(rating_sum / rating_count, 2)
+
+    def update_rating_aggregates(self, db_con: sqlite3.Connection, ratings_by_id: dict):
+        db_con.executemany(RATING_AGGREGATE_UPSERT_QUERY,
+                           [[item_id, rating_sum, rating_count]
+                            for item_id, (rating_sum, rating_count) in ratings_by_id.items()])
+
+        if self.args.append:
+            # items already in DB get overallRating from their updated aggregates, rounded the same way as new items
+            rows = fetch_in_chunks(db_con, ITEM_RATING_AGGREGATES_QUERY, ratings_by_id)
+            db_con.executemany(OVERALL_RATING_UPDATE_QUERY,
+                               [[self.get_overall_rating(rating_sum, rating_count), item_id]
+                                for item_id, rating_sum, rating_count in rows])
+
+    def load_ratings_by_id(self, db_con: sqlite3.Connection) -> dict:
+        cursor = db_con.execute(RATING_AGGREGATES_QUERY)
+        return {item_id: [rating_sum, rating_count] for item_id, rating_sum, rating_count in cursor}
+
+    def insert_review_batch(self, db_con: sqlite3.Connection, to_insert_user: list, to_insert_review: list,
+                            ratings_by_id: dict):
+        started = datetime.now()
+        db_con.executemany(USER_INSERT_QUERY, to_insert_user)
+        self.count_inserted("users", len(to_insert_user), started)
+
+        # the inserted reviews get ids after the last id before the batch
+        started = datetime.now()
+        last_review_id = db_con.execute(LAST_REVIEW_ID_QUERY).fetchone()[0] or 0
+        db_con.executemany(REVIEW_APPEND_QUERY if self.args.append else REVIEW_INSERT_QUERY, to_insert_review)
+        self.count_inserted("reviews", len(to_insert_review), started)
+
+        # aggregate ratings from inserted reviews for items
+        inserted = 0
+        for item_id, item_rating in db_con.execute(NEW_RATINGS_QUERY, [last_review_id]):
+            if item_id in ratings_by_id:
+                ratings_by_id[item_id][0] += item_rating
+                ratings_by_id[item_id][1] += 1
+            else:
+                ratings_by_id[item_id] = [item_rating, 1]
+            inserted += 1
+
+        return inserted
 
     def parse_review_file(self, db_con: sqlite3.Connection):
-        self.log("Parsing a file '{}'...".format(self.args.review_file))
+        offset, finished = self.get_checkpoint(db_con, self.args.review_file)
+        if finished:
+            self.log_billboard(["File '{}' was already parsed, skipping.".format(self.args.review_file)])
+            return
+        self.log("Parsing a file '{}' from offset {}...".format(self.args.review_file, offset))
+        started = datetime.now()
 
         count = 0
+        inserted = 0
         to_insert_user = []
         to_insert_review = []
+        # running aggregates of ratings in format {item_id: [sum, count]}, in append mode only for the current batch
         ratings_by_id = {}
 
-        # loop through reviews in review_file
-        for review in self.parse(self.args.review_file):
+        # loop through reviews in review_file, parsed rows are inserted batch by batch
+        for offset, review in self.parse(self.args.review_file, offset):
             count += 1
 
             # parse review's data
@@ -91,177 +254,153 @@ class DBSetup:
                 print(review)
                 raise
 
-            # collect ratings from reviews for items
-            if item_id in ratings_by_id:
-                ratings_by_id[item_id].append(item_rating)
-            else:
-                ratings_by_id[item_id] = [item_rating]
-
             # collect review and user data to insert
             to_insert_user.append([user_id, user_name])
             to_insert_review.append([user_id, item_id, item_rating, review_time])
 
-        # insert parsed data into DB tables batch by batch
-        for batch in self.get_chunks(to_insert_user, 1000):
-            query = '''INSERT OR IGNORE INTO user(id, name) 
-                       VALUES {}'''.format(",".join(
-                ["(\"{}\", \"{}\")".format(user_id, self.escape(user_name))
-                 for (user_id, user_name) in batch]))
-            db_con.execute(query)
-            db_con.commit()
+            if len(to_insert_review) == BATCH_SIZE:
+                inserted += self.insert_review_batch(db_con, to_insert_user, to_insert_review, ratings_by_id)
+                to_insert_user, to_insert_review = [], []
 
-        for batch in self.get_chunks(to_insert_review, 1000):
-            query = '''INSERT INTO review(userId, itemId, rating, reviewTime) 
-                       VALUES {}'''.format(",".join(
-                ["(\"{}\", \"{}\", \"{}\", \"{}\")".format(user_id, item_id, item_rating, review_time)
-                 for user_id, item_id, item_rating, review_time in batch]))
-            db_con.execute(query)
-            db_con.commit()
+                if self.args.append:
+                    self.update_rating_aggregates(db_con, ratings_by_id)
+                    ratings_by_id = {}
+                    self.commit_batch(db_con, self.args.review_file, offset)
 
-        self.log_billboard(["Parsing of reviews is DONE!", "Reviews parsed: {}".format(count)])
+        inserted += self.insert_review_batch(db_con, to_insert_user, to_insert_review, ratings_by_id)
+        self.update_rating_aggregates(db_con, ratings_by_id)
+        self.commit_batch(db_con, self.args.review_file, offset, finished=True)
 
-        return ratings_by_id
+        self.log_billboard(["Parsing of reviews is DONE!", "Reviews parsed: {}".format(count),
+                            "Reviews parsed per second: {}".format(self.rows_per_second(count, started)),
+                            "Users inserted per second: {}".format(self.inserted_per_second("users")),
+                            "Reviews inserted per second: {}".format(self.inserted_per_second("reviews")),
+                            "Reviews inserted: {}".format(inserted)])
 
-    def generate_meta_items(self):
-        # loop through all items in meta_file
-        for item in self.parse(self.args.meta_file):
-            # parse item's metadata
-            try:
-                item_id = item.get("asin")
+    def get_item_data(self, item: dict) -> list:
+        # parse item's metadata
+        try:
+            item_id = item.get("asin")
 
-                item_title = item.get("title", None)
-                item_description = item.get("description", None)
-                item_price = item.get("price", "NULL")
-                item_image_url = item.get("imUrl", None)
+            item_title = item.get("title", None)
+            item_description = item.get("description", None)
+            item_price = item.get("price", None)
+            item_image_url = item.get("imUrl", None)
 
-                sales = item.get("salesRank", None)
-                sales_category = None
-                sales_rank = None
+            sales = item.get("salesRank", None)
+            sales_category = None
+            sales_rank = None
 
-                if sales is not None:
-                    for key, value in sales.items():
-                        sales_category, sales_rank = key, value
+            if sales is not None:
+                for key, value in sales.items():
+                    sales_category, sales_rank = key, value
 
-                if sales_rank is None:
-                    sales_rank = "NULL"
+        except NameError:
+            print("ERROR: Following item is missing at least one of the required attributes"
+                  "(asin):")
+            print(item)
+            raise
 
-            except NameError:
-                print("ERROR: Following item is missing at least one of the required attributes"
-                      "(asin):")
-                print(item)
-                raise
+        return [item_id, item_title, item_description, item_price, item_image_url, sales_category, sales_rank]
 
-            yield [item_id, item_title, item_description, item_price, item_image_url, sales_category, sales_rank]
-
-    def insert_meta_batch(self, db_con: sqlite3.Connection, batch: list):
-        if batch:
-            query = '''INSERT INTO 
-                       item(id, title, description, price, imageUrl, salesCategory, salesRank, overallRating) 
-                       VALUES {}'''.format(",".join(
-                ["(\"{}\", \"{}\", \"{}\", {}, \"{}\", \"{}\", {}, {})".format(item_id, self.escape(item_title),
-                                                                               self.escape(item_description),
-                                                                               item_price, item_image_url,
-                                                                               sales_category, sales_rank, rating)
-                 for (item_id, item_title, item_description, item_price, item_image_url, sales_category, sales_rank,
-                      rating) in batch]))
-            db_con.execute(query)
-            db_con.commit()
+    def get_category_id(self, db_con: sqlite3.Connection, inserted_categories: dict, category_hierarchy_array: list):
+        # insert not yet seen categories of the hierarchy and return id of the most specific one
+        namespace = ''
+        previous_category_id = None
+
+        for category in category_hierarchy_array:
+            namespace += '.' + category
+
+            if namespace in inserted_categories:
+                previous_category_id = inserted_categories[namespace]
+            else:
+                cursor = db_con.execute(CATEGORY_INSERT_QUERY, [previous_category_id, namespace, category])
+                inserted_id = cursor.lastrowid
+                previous_category_id = inserted_id
+                inserted_categories[namespace] = inserted_id
+                cursor.close()
+
+        return previous_category_id
+
+    def insert_meta_batch(self, db_con: sqlite3.Connection, to_insert_item: list, to_insert_item_category: list,
+                          to_insert_related: list):
+        # items which are already in DB are skipped by primary key
+        started = datetime.now()
+        db_con.executemany(ITEM_INSERT_QUERY, to_insert_item)
+        self.count_inserted("items", len(to_insert_item), started)
+        started = datetime.now()
+        db_con.executemany(ITEM_CATEGORY_APPEND_QUERY if self.args.append else ITEM_CATEGORY_INSERT_QUERY,
+                           to_insert_item_category)
+        self.count_inserted("item categories", len(to_insert_item_category), started)
+        started = datetime.now()
+        db_con.executemany(ITEM_RELATED_APPEND_QUERY if self.args.append else ITEM_RELATED_INSERT_QUERY,
+                           to_insert_related)
+        self.count_inserted("item relations", len(to_insert_related), started)
 
     def parse_meta_file(self, db_con: sqlite3.Connection, ratings_by_id: dict):
-        self.log("Parsing a file '{}'...".format(self.args.meta_file))
+        offset, finished = self.get_checkpoint(db_con, self.args.meta_file)
+        if finished:
+            self.log_billboard(["File '{}' was already parsed, skipping.".format(self.args.meta_file)])
+            return
+        self.log("Parsing a file '{}' from offset {}...".format(self.args.meta_file, offset))
+        started = datetime.now()
 
         count = 0
-        to_insert_items = []
+        kept = 0
+        # dictionary for inserted_categories in format {namespace: id}
+        inserted_categories = {namespace: category_id for namespace, category_id
+                               in db_con.execute(CATEGORY_IDS_QUERY)}
+        to_insert_item = []
+        to_insert_item_category = []
+        to_insert_related = []
 
-        for item_data in self.generate_meta_items():
+        # single pass through meta_file, items without reviews are filtered out
+        for offset, item in self.parse(self.args.meta_file, offset):
             count += 1
 
+            item_data = self.get_item_data(item)
             item_id = item_data[0]
-            review_count = len(ratings_by_id[item_id]) if item_id in ratings_by_id else 0
-
-            if review_count > 0:
-                overall_rating = round((sum(ratings_by_id[item_id]) / len(ratings_by_id[item_id])), 2)
-                item_data.append(overall_rating)
-                to_insert_items.append(item_data)
-
-            if len(to_insert_items) == 1000:
-                self.insert_meta_batch(db_con, to_insert_items)
-                to_insert_items = []
-
-        self.insert_meta_batch(db_con, to_insert_items)
-
-        self.log_billboard(["Parsing of all products is DONE!", "Products parsed: {}".format(count)])
-
-    def parse_related_and_categories(self, db_con: sqlite3.Connection):
-        self.log("Parsing 'related' and 'categories' for products...")
-
-        # get filtered out items
-        cursor = db_con.execute("SELECT id FROM item")
-        filtered_items = [item[0] for item in cursor.fetchall()]
-
-        count = 0
-        inserted_categories = {}  # dictionary for inserted_categories in format {namespace: id}
-        to_insert_related = []
-        to_insert_item_category = []
 
-        # loop the file again and for each filtered item parse rest of metadata
-        for item in self.parse(self.args.meta_file):
-            item_id = item.get("asin")
-
-            # continue if item was filtered out
-            if item_id not in filtered_items:
+            if item_id not in ratings_by_id:
                 continue
-            else:
-                count += 1
+
+            item_data.append(self.get_overall_rating(*ratings_by_id[item_id]))
+            to_insert_item.append(item_data)
+            kept += 1
 
             categories = item.get("categories", None)
             related = item.get("related", None)
 
+            # relations to items missing in meta_file are deleted at the end of the file
             if related is not None:
                 for key in related.keys():
                     for related_item_id in related.get(key):
-                        if related_item_id in filtered_items:
+                        if related_item_id in ratings_by_id:
                             to_insert_related.append([item_id, related_item_id, key])
 
             if categories is not None:
                 for category_hierarchy_array in categories:
-                    namespace = ''
-                    previous_category_id = None
-
-                    for category in category_hierarchy_array:
-                        namespace += '.' + category
-
-                        if namespace in inserted_categories:
-                            previous_category_id = inserted_categories[namespace]
-                        else:
-                            cursor = db_con.execute("INSERT INTO category(parentCategoryId, namespace, name) "
-                                                    "VALUES (?, ?, ?)",
-                                                    [previous_category_id, namespace, category])
-                            inserted_id = cursor.lastrowid
-                            previous_category_id = inserted_id
-                            inserted_categories[namespace] = inserted_id
-                            cursor.close()
-
-                    to_insert_item_category.append([item_id, previous_category_id])
-            db_con.commit()
-
-        for batch in self.get_chunks(to_insert_item_category, 1000):
-            query = '''INSERT INTO item_category_list(itemId, categoryId) 
-                       VALUES {}'''.format(",".join(
-                ["(\"{}\", {})".format(item_id, category_id)
-                 for item_id, category_id in batch]))
-            db_con.execute(query)
-            db_con.commit()
-
-        for batch in self.get_chunks(to_insert_related, 1000):
-            query = '''INSERT INTO item_related_list(itemId, relatedItemId, relation) 
-                       VALUES {}'''.format(",".join(
-                ["(\"{}\", \"{}\", \"{}\")".format(item_id, related_item_id, key)
-                 for item_id, related_item_id, key in batch]))
-            db_con.execute(query)
-            db_con.commit()
-
-        self.log_billboard(["Parsing of extra data is DONE!", "Products parsed: {}".format(count)])
+                    category_id = self.get_category_id(db_con, inserted_categories, category_hierarchy_array)
+                    to_insert_item_category.append([item_id, category_id])
+
+            if len(to_insert_item) == BATCH_SIZE:
+                self.insert_meta_batch(db_con, to_insert_item, to_insert_item_category, to_insert_related)
+                to_insert_item, to_insert_item_category, to_insert_related = [], [], []
+                self.commit_batch(db_con, self.args.meta_file, offset)
+
+        self.insert_meta_batch(db_con, to_insert_item, to_insert_item_category, to_insert_related)
+        db_con.execute(RELATED_CLEANUP_QUERY)
+        self.commit_batch(db_con, self.args.meta_file, offset, finished=True)
+
+        self.log_billboard(["Parsing of all products is DONE!", "Products parsed: {}".format(count),
+                            "Products parsed per second: {}".format(self.rows_per_second(count, started)),
+                            "Products with reviews: {}".format(kept),
+                            "Items inserted per second: {}".format(self.inserted_per_second("items")),
+                            "Item categories inserted per second: {}".format(
+                                self.inserted_per_second("item categories")),
+                            "Item relations inserted per second: {}".format(
+                                self.inserted_per_second("item relations")),
+                            "Categories: {}".format(len(inserted_categories))])
 
     def run(self):
         global LAST_TIME_CHECKPOINT
@@ -272,12 +411,40 @@ class DBSetup:
         self.log("Preparing DB...")
         db_con = create_connection()
         self.prepare_tables(db_con)
+
+        if self.args.append:
+            self.prepare_append(db_con)
+        elif db_con.execute(ANY_REVIEW_QUERY).fetchone():
+            raise Exception("DB is already populated, use --append to add new reviews and metadata into it.")
         self.log_billboard(["Preparation of DB is DONE!"])
 
         # parse input files
-        ratings_by_id = self.parse_review_file(db_con)
-        self.parse_meta_file(db_con, ratings_by_id)
-        self.parse_related_and_categories(db_con)
+        self.parse_review_file(db_con)
+        self.parse_meta_file(db_con, self.load_ratings_by_id(db_con))
+
+        self.log("Building category closure...")
+        build_category_closure(db_con)
+        self.log_billboard(["Building of category closure is DONE!"])
+
+        # indexes are built after the load at once, it is faster than updating them with every insert
+        self.log("Building indexes...")
+        self.build_indexes(db_con)
+        self.log_billboard(["Building of indexes is DONE!"])
+
+        # the best rated items of categories, naive algorithms read them instead of sorting whole categories
+        self.log("Building category rankings...")
+        build_category_rankings(db_con)
+        self.log_billboard(["Building of category rankings is DONE!"])
+
+        # new items, users and categories get their integer codes, existing ones keep theirs
+        self.log("Interning ids...")
+        refresh_interners(db_con)
+        self.log_billboard(["Interning of ids is DONE!"])
+
+        # processes which loaded data from DB meanwhile load them again with the closure, rankings and interned ids
+        # of this run
+        db_con.execute("PRAGMA user_version = {}".format(db_con.execute("PRAGMA user_version").fetchone()[0] + 1))
+        db_con.commit()
 
         db_con.execute("PRAGMA foreign_keys = on")
         db_con.close()
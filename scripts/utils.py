@@ -1,7 +1,27 @@
+import os
 import sqlite3
+import time
+from contextlib import contextmanager
 from sqlite3 import Error
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, files are locked by msvcrt there
+    fcntl = None
+    import msvcrt
 
 PATH_TO_DB = "data/amazon_product_data.db"
+# SQLite limits the number of parameters of one query (999 before version 3.32)
+MAX_QUERY_PARAMETERS = 999
+# seconds between two checks of the DB file by DBChangeWatcher
+DB_CHECK_INTERVAL = 5
+# tables filled by setup_db.py, their last rowids are a part of the DB fingerprint
+FINGERPRINT_TABLES = ["item", "review", "item_related_list", "category", "item_category_list"]
+# last rowid of a table of FINGERPRINT_TABLES
+LAST_ROWID_QUERY = "SELECT ifnull(max(rowid), 0) FROM {}"
+CHECKPOINTS_STATE_QUERY = "SELECT count(*), ifnull(sum(offset), 0), ifnull(sum(finished), 0) FROM ingest_checkpoint"
 
 
 def create_connection() -> sqlite3.Connection:
@@ -13,3 +33,110 @@ def create_connection() -> sqlite3.Connection:
         print(e)
 
     return connection
+
+
+# Run the query, which has "IN ({})" in it, for chunks of values and return all rows, so a set of ids is fetched with
+# a few queries instead of one query per id.
+def fetch_in_chunks(connection: sqlite3.Connection, query: str, values: iter) -> list:
+    values = list(values)
+    rows = []
+    for start in range(0, len(values), MAX_QUERY_PARAMETERS):
+        chunk = values[start:start + MAX_QUERY_PARAMETERS]
+        rows.extend(connection.execute(query.format(",".join(["?"] * len(chunk))), chunk).fetchall())
+    return rows
+
+
+# Hold an exclusive lock of the file (created if missing) shared by all processes until the block ends, by flock on
+# POSIX and by locking the first byte of the file on Windows.
+@contextmanager
+def lock_file(path: str):
+    with open(path, "a") as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 attempts, one per second
+                    continue
+
+        try:
+            yield
+        finally:
+            if fcntl is None:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Return a fingerprint of the data loaded into DB: the last rowids of the tables filled by setup_db.py, the state of
+# its ingest checkpoints and the number of its finished runs (user_version). It changes whenever setup_db.py adds data,
+# also in append mode, which updates ratings of items already in DB, and once more when the run with all its build
+# steps is finished, while feedback writes leave it as it is. It costs a few indexed lookups.
+def get_db_fingerprint(connection: sqlite3.Connection = None) -> list:
+    db_con = connection or create_connection()
+
+    fingerprint = [db_con.execute(LAST_ROWID_QUERY.format(table)).fetchone()[0] for table in FINGERPRINT_TABLES]
+    fingerprint.extend(db_con.execute(CHECKPOINTS_STATE_QUERY).fetchone())
+    fingerprint.append(db_con.execute("PRAGMA user_version").fetchone()[0])
+
+    if connection is None:
+        db_con.close()
+    return fingerprint
+
+
+class DBChangeWatcher:
+    # Tells whether data in DB changed since the previous change it reported, the first call reports a change. The
+    # modification time of the DB file is checked at most once per DB_CHECK_INTERVAL seconds and the fingerprint is
+    # read only when the file was modified, so it can be asked on every request. Data loaded once per process are
+    # loaded again when it reports a change.
+    interval: float
+    checked: float
+    modified: float
+    fingerprint: list
+
+    def __init__(self, interval: float = DB_CHECK_INTERVAL):
+        self.interval = interval
+        self.checked = None
+        self.modified = None
+        self.fingerprint = None
+
+    def changed(self) -> bool:
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.interval:
+            return False
+        self.checked = now
+
+        modified = os.path.getmtime(PATH_TO_DB)
+        if modified == self.modified:
+            return False
+        self.modified = modified
+
+        fingerprint = get_db_fingerprint()
+        if fingerprint == self.fingerprint:
+            return False
+        self.fingerprint = fingerprint
+        return True
+
+
+class DBChangeCache:
+    # Value built by build() once per process and again when DBChangeWatcher reports that data in DB changed, e.g.
+    # a graph or a model loaded from DB. One caller builds it at a time, callers holding the old value keep using it.
+    build: callable
+    value: object
+    lock: Lock
+    watcher: DBChangeWatcher
+
+    def __init__(self, build: callable):
+        self.build = build
+        self.value = None
+        self.lock = Lock()
+        self.watcher = DBChangeWatcher()
+
+    def get(self):
+        with self.lock:
+            if self.watcher.changed() or self.value is None:
+                self.value = self.build()
+        return self.value